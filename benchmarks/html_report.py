@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+#
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+#
+# Time the HTML report of many files, and the rendering of its index page
+# alone, with the index rows as an HTML table and as JSON:
+#
+#   PYTHONPATH=. python benchmarks/html_report.py --files 50000
+#
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from gcovr.data import CoverageData
+from gcovr.html_report import print_html_report, html_row, get_template
+
+
+class Options(object):
+    root = '/src'
+    root_filter = re.compile('^' + re.escape('/src' + os.sep))
+    output = None
+    html_details = False
+    show_branch = None
+    sort_uncovered = None
+    sort_percent = None
+    gzip = False
+    html_index = 'table'
+
+
+def make_covdata(files, lines):
+    covdata = {}
+    for i in range(files):
+        fname = '/src/dir%d/file%d.cpp' % (i % 100, i)
+        covered = dict((line, 1) for line in range(1, lines, 2))
+        uncovered = set(range(2, lines, 2))
+        branches = {1: {0: 1, 1: i % 2}}
+        covdata[fname] = CoverageData(fname, uncovered, set(), covered,
+                                      branches, set())
+    return covdata
+
+
+def render_index(files):
+    rows = [html_row(True, '/out/index.dir%d_file%d.cpp.html' % (i % 100, i),
+                     directory='dir%d/' % (i % 100),
+                     filename='dir%d/file%d.cpp' % (i % 100, i),
+                     LinesExec=i % 20, LinesTotal=20,
+                     LinesCoverage=5.0 * (i % 20),
+                     BranchesExec=i % 2, BranchesTotal=2,
+                     BranchesCoverage=50.0 * (i % 2))
+            for i in range(files)]
+    root_page = get_template('index.html', Options())
+    start = time.time()
+    root_page.render(ROWS=rows)
+    return time.time() - start
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for i in range(repeat):
+        elapsed = func(*args)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def print_report(covdata, outdir, html_index):
+    options = Options()
+    options.output = os.path.join(outdir, 'index.html')
+    options.html_index = html_index
+    start = time.time()
+    print_html_report(covdata, options)
+    return time.time() - start
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--files", type="int", default=50000,
+                      help="The number of source files.")
+    parser.add_option("--lines", type="int", default=20,
+                      help="The number of lines per source file.")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="Report the best of this many runs.")
+    (opts, args) = parser.parse_args()
+
+    sys.stdout.write("%d files: index page %8.3f s\n"
+                     % (opts.files,
+                        best_of(opts.repeat, render_index, opts.files)))
+    covdata = make_covdata(opts.files, opts.lines)
+    outdir = tempfile.mkdtemp(prefix='gcovr-bench-')
+    try:
+        for html_index in ('table', 'json'):
+            elapsed = best_of(opts.repeat, print_report, covdata, outdir,
+                              html_index)
+            size = os.path.getsize(os.path.join(outdir, 'index.html'))
+            sys.stdout.write("%d files: %-5s report %8.3f s, index %d kB\n"
+                             % (opts.files, html_index, elapsed,
+                                size // 1024))
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+#
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+#
+# Time the startup of gcovr: the import of the package alone, and with
+# each of its reporters, and the compilation of the HTML templates, without
+# and with a (warm) --cache-dir, in fresh interpreters:
+#
+#   PYTHONPATH=. python benchmarks/startup.py
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+
+def run(statements):
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statements],
+                              stdout=devnull)
+        return time.time() - start
+
+
+def best_of(repeat, statements):
+    best = None
+    for i in range(repeat):
+        elapsed = run(statements)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--repeat", type="int", default=10,
+                      help="Report the best of this many runs.")
+    (opts, args) = parser.parse_args()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, 'scripts', 'gcovr')
+    cases = [
+        ("python", "pass"),
+        ("gcovr --version", "import sys; sys.argv = ['gcovr', '--version']; "
+         "exec(compile(open(%r).read(), 'gcovr', 'exec'))" % script),
+        ("import gcovr", "import gcovr"),
+    ]
+    for format in ('txt', 'xml', 'html'):
+        cases.append(("%s reporter" % format,
+                      "import gcovr; gcovr.get_reporter(%r)" % format))
+    cache_dir = tempfile.mkdtemp(prefix='gcovr-bench-')
+    for (name, directory) in (("html templates", None),
+                              ("cached templates", cache_dir)):
+        cases.append((name, templates % directory))
+    try:
+        run(templates % cache_dir)
+        for (name, statements) in cases:
+            sys.stdout.write("%-16s %8.3f s\n"
+                             % (name, best_of(opts.repeat, statements)))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+templates = """
+import gcovr.html_report
+class Options(object):
+    cache_dir = %r
+for name in ('index.html', 'index_json.html', 'source.html'):
+    gcovr.html_report.get_template(name, Options())
+"""
+
+
+if __name__ == '__main__':
+    main()
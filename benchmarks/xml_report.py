@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+#
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+#
+# Compare the cost of the dense and the pretty XML reports on synthetic
+# coverage data:
+#
+#   PYTHONPATH=. python benchmarks/xml_report.py --files 500 --lines 2000
+#
+
+import os
+import re
+import sys
+import time
+from optparse import OptionParser
+
+from gcovr.data import CoverageData
+from gcovr.xml_report import print_xml_report
+
+
+class Options(object):
+    root = '/src'
+    root_filter = re.compile('^' + re.escape('/src' + os.sep))
+    output = os.devnull
+    prettyxml = False
+
+
+def make_covdata(files, lines):
+    covdata = {}
+    for i in range(files):
+        fname = '/src/dir%d/file%d.cpp' % (i % 20, i)
+        covered = dict((line, line % 7) for line in range(1, lines, 2))
+        uncovered = set(range(2, lines, 2))
+        branches = dict((line, {0: 1, 1: line % 3})
+                        for line in range(1, lines, 10))
+        covdata[fname] = CoverageData(fname, uncovered, set(), covered,
+                                      branches, set())
+    return covdata
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--files", type="int", default=200,
+                      help="The number of source files.")
+    parser.add_option("--lines", type="int", default=2000,
+                      help="The number of lines per source file.")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="Report the best of this many runs.")
+    (opts, args) = parser.parse_args()
+
+    covdata = make_covdata(opts.files, opts.lines)
+    options = Options()
+    sys.stdout.write("%d files, %d lines\n"
+                     % (opts.files, opts.files * opts.lines))
+    for (name, pretty) in (("dense", False), ("pretty", True)):
+        options.prettyxml = pretty
+        best = None
+        for i in range(opts.repeat):
+            start = time.time()
+            print_xml_report(covdata, options)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        sys.stdout.write("%-8s %8.3f s\n" % (name, best))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,11 +10,43 @@
 
 # Empty gcovr package
 
+import importlib
+
 from .data import gcov_prefix_split
 from .data import is_gcda
 from .data import is_gcno
 from .data import process_files
 from .version import version_str
-from .xml_report import print_xml_report
-from .text_report import print_text_report
-from .html_report import print_html_report
+
+#
+# The reporters, by format: the module and the function that print the
+# report.  A reporter module (and the templates and libraries it needs) is
+# only imported when its report is printed.
+#
+reporters = {
+    'xml': ('.xml_report', 'print_xml_report'),
+    'html': ('.html_report', 'print_html_report'),
+    'txt': ('.text_report', 'print_text_report'),
+    'lcov': ('.lcov_report', 'print_lcov_report'),
+}
+
+
+def get_reporter(format):
+    (module, function) = reporters[format]
+    return getattr(importlib.import_module(module, __name__), function)
+
+
+def print_xml_report(covdata, options):
+    get_reporter('xml')(covdata, options)
+
+
+def print_text_report(covdata, options):
+    get_reporter('txt')(covdata, options)
+
+
+def print_html_report(covdata, options):
+    get_reporter('html')(covdata, options)
+
+
+def print_lcov_report(covdata, options):
+    get_reporter('lcov')(covdata, options)
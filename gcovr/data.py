@@ -10,18 +10,28 @@
 
 
 import copy
+import json
+import numbers
 import os
 import re
-import sre_compile
-import sre_constants
-import sre_parse
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 output_re = re.compile("[Cc]reating [`'](.*)'$")
 source_re = re.compile("cannot open (source|graph) file")
+# The first line of each gcov file in the output of gcov --stdout
+stdout_source_re = re.compile(br'^\s*-:\s*0:Source:(.*?)\s*$')
 
 
 def is_gcno(path):
@@ -34,12 +44,29 @@ def is_gcda(path):
     return ext == ".gcda"
 
 
-def gcov_prefix_split(path, prefix, strip):
+def cached_path_exists():
+    """Return a replacement for os.path.exists() that caches its results.
+    It is made for each run, to share the directories probed by
+    gcov_prefix_split() between the data files; the object tree does not
+    change during a run."""
+    cache = {}
+
+    def path_exists(path):
+        try:
+            return cache[path]
+        except KeyError:
+            exists = cache[path] = os.path.exists(path)
+            return exists
+    return path_exists
+
+
+def gcov_prefix_split(path, prefix, strip, path_exists=os.path.exists):
     """Split the PATH to a gcov data file based on the gcov PREFIX and STRIP
     into (head, prefix, file).  Where os.path.join(head, file) would yield the
     path to where gcov expects to find the data file.
     This function is only useful if the application was run with
-    GCOV_PREFIX/GCOV_PREFIX_STRIP set in the environment."""
+    GCOV_PREFIX/GCOV_PREFIX_STRIP set in the environment.  The directories
+    are probed with PATH_EXISTS (see cached_path_exists())."""
     if os.path.isabs(prefix):
         strip += 1
     split = path.split(os.sep)
@@ -49,7 +76,7 @@ def gcov_prefix_split(path, prefix, strip):
     prefix = [tail.pop(0)]
     for elem in tail:
         path = os.path.join(head, *tail)
-        if os.path.exists(path):
+        if path_exists(path):
             break
         prefix.append(tail.pop(0))
 
@@ -84,7 +111,7 @@ class ParameterValueError(ValueError):
 class CoverageData(object):
 
     def __init__(self, fname, uncovered, uncovered_exceptional, covered,
-                 branches, noncode):
+                 branches, noncode, functions=None, unexecuted_branches=None):
         self.fname = fname
         # Shallow copies are cheap & "safe" because the caller will
         # throw away their copies of covered & uncovered after calling
@@ -98,9 +125,17 @@ class CoverageData(object):
         self.all_lines.update(uncovered_exceptional)
         self.all_lines.update(covered.keys())
         self.branches = copy.deepcopy(branches)
+        # The (first line, calls) of the functions, by name
+        self.functions = dict(functions or {})
+        # The numbers of the branches that gcov reported as "never
+        # executed", by line.  They are not in BRANCHES, so that the branch
+        # counts of the other reports do not change; a branch that any data
+        # file executed is removed.
+        self.unexecuted_branches = {}
+        self._update_unexecuted_branches(unexecuted_branches or {})
 
     def update(self, uncovered, uncovered_exceptional, covered, branches,
-               noncode):
+               noncode, functions=None, unexecuted_branches=None):
         self.all_lines.update(uncovered)
         self.all_lines.update(uncovered_exceptional)
         self.all_lines.update(covered.keys())
@@ -113,9 +148,23 @@ class CoverageData(object):
             for b in branches[k]:
                 d = self.branches.setdefault(k, {})
                 d[b] = d.get(b, 0) + branches[k][b]
+        for (name, (line, calls)) in (functions or {}).items():
+            if name in self.functions:
+                (line, total) = self.functions[name]
+                calls += total
+            self.functions[name] = (line, calls)
+        self._update_unexecuted_branches(unexecuted_branches or {})
         self.uncovered.difference_update(self.covered.keys())
         self.uncovered_exceptional.difference_update(self.covered.keys())
 
+    def _update_unexecuted_branches(self, unexecuted_branches):
+        for (line, numbers) in unexecuted_branches.items():
+            self.unexecuted_branches.setdefault(line, set()).update(numbers)
+        for (line, numbers) in list(self.unexecuted_branches.items()):
+            numbers.difference_update(self.branches.get(line, ()))
+            if not numbers:
+                del self.unexecuted_branches[line]
+
     def uncovered_str(self, exceptional, show_branch):
         if show_branch:
             # Don't do any aggregation on branch results
@@ -205,22 +254,29 @@ class CoverageData(object):
 class GcovParser(object):
     exclude_line_pattern = re.compile('([GL]COVR?)_EXCL_(LINE|START|STOP)')
     c_style_comment_pattern = re.compile('/\*.*?\*/')
+    function_pattern = re.compile(r'^function (.*) called (\d+) ')
     cpp_style_comment_pattern = re.compile('//.*?$')
 
     class _State(object):
-        is_code_statement = False
-        filename = None
-        uncovered = set()
-        uncovered_exceptional = set()
-        covered = {}
-        branches = {}
-        excluding = []
-        segments = []
-        noncode = set()
-        lineno = 0
-        last_code_line = ""
-        last_code_lineno = 0
-        last_code_line_excluded = False
+        # NB: the containers must be created per instance; class-level
+        # defaults would be shared by (and leak between) every parse.
+        def __init__(self):
+            self.is_code_statement = False
+            self.filename = None
+            self.uncovered = set()
+            self.uncovered_exceptional = set()
+            self.covered = {}
+            self.branches = {}
+            self.unexecuted_branches = {}
+            self.functions = {}
+            self.excluding = []
+            self.line = ""
+            self.segments = []
+            self.noncode = set()
+            self.lineno = 0
+            self.last_code_line = ""
+            self.last_code_lineno = 0
+            self.last_code_line_excluded = False
 
     def __init__(self, root_dir, file_filter, root_filter, exclude,
                  exclude_unreachable_branches, verbose=False):
@@ -244,16 +300,11 @@ class GcovParser(object):
             (r'^function.*', self._s_function),
             (r'^f.*', self._s_f),
             (r'.*_EXCL_.*', self._s_exclude)]
-        parser = []
-        pattern = sre_parse.Pattern()
-        for phrase, action in lexicon:
-            data = [(sre_constants.SUBPATTERN,
-                     (len(parser) + 1, sre_parse.parse(phrase, 0)))]
-            parser.append(sre_parse.SubPattern(pattern, data))
-        pattern.groups = len(parser) + 1
-        data = [(sre_parse.BRANCH, (None, parser))]
-        parser = sre_parse.SubPattern(pattern, data)
-        return lexicon, sre_compile.compile(parser)
+        # One group per phrase, so that match.lastindex identifies the
+        # action (NB: the phrases themselves must not contain groups)
+        scanner = re.compile("|".join(["(%s)" % phrase
+                                       for phrase, action in lexicon]))
+        return lexicon, scanner
 
     def _s_code(self, state, match):
         state.is_code_statement = True
@@ -309,21 +360,30 @@ class GcovParser(object):
                                  "line %d in file %s (%s).\n"
                                  % (state.lineno, state.filename,
                                     exclude_reason))
-            else:
-                fields = match.string.split()
-                try:
-                    count = int(fields[3])
-                    field = int(fields[1])
-                    state.branches.setdefault(state.lineno, {})[field] = count
-                except:
-                    # We ignore branches that were "never executed"
-                    pass
+        else:
+            fields = match.string.split()
+            try:
+                count = int(fields[3])
+                field = int(fields[1])
+                state.branches.setdefault(state.lineno, {})[field] = count
+            except:
+                # The branches that were "never executed" are only kept
+                # for the LCOV report
+                if fields[2:4] == ['never', 'executed']:
+                    state.unexecuted_branches.setdefault(
+                        state.lineno, set()).add(int(fields[1]))
 
     def _s_call(self, state, match):
         pass
 
     def _s_function(self, state, match):
-        pass
+        # The record precedes the first line of the function.  The whole
+        # line is parsed, as a (demangled) name may contain colons.
+        match = GcovParser.function_pattern.match(state.line)
+        if match and not state.excluding:
+            (name, calls) = (match.group(1), int(match.group(2)))
+            (line, total) = state.functions.get(name, (state.lineno + 1, 0))
+            state.functions[name] = (line, total + calls)
 
     def _s_f(self, state, match):
         pass
@@ -374,6 +434,7 @@ class GcovParser(object):
             i = j
 
     def _parse_line(self, state, line):
+        state.line = line
         state.segments = line.split(":", 2)
         if len(state.segments) > 1:
             try:
@@ -395,17 +456,21 @@ class GcovParser(object):
         if state.excluding and not state.excluding[-1]:
             state.excluding.pop()
 
-    def _update_coverage_data(self, state, coverage_data):
+    def update_coverage_data(self, state, coverage_data):
+        """Merge the STATE returned by parse_file() into COVERAGE_DATA."""
         if not state.filename in coverage_data:
             data = CoverageData(state.filename, state.uncovered,
                                 state.uncovered_exceptional, state.covered,
-                                state.branches, state.noncode)
+                                state.branches, state.noncode,
+                                state.functions, state.unexecuted_branches)
             coverage_data[state.filename] = data
         else:
             coverage_data[state.filename].update(state.uncovered,
                                                  state.uncovered_exceptional,
                                                  state.covered, state.branches,
-                                                 state.noncode)
+                                                 state.noncode,
+                                                 state.functions,
+                                                 state.unexecuted_branches)
 
     def _is_excluded_file(self, filename):
         filtered_fname = None
@@ -434,7 +499,9 @@ class GcovParser(object):
                 return True
         return False
 
-    def parse(self, filename, coverage_data):
+    def parse_file(self, filename):
+        """Parse the gcov file FILENAME, returning the parser state (or None
+        if the source file it describes is filtered out)."""
         file_input = open(filename, "r")
         state = GcovParser._State()
         # Get the filename
@@ -449,62 +516,90 @@ class GcovParser(object):
         if len(state.segments) != 4 or not ends_with_source:
             raise GcovParserError(line.rstrip())
 
-        currdir = os.getcwd()
-        os.chdir(self.root_dir)
-        state.filename = os.path.abspath((state.segments[-1]).strip())
-        os.chdir(currdir)
+        state.filename = os.path.normpath(
+            os.path.join(self.root_dir, (state.segments[-1]).strip()))
         if self.verbose:
             sys.stdout.write("Parsing coverage data for file %s\n"
                              % state.filename)
 
         if self._is_excluded_file(state.filename):
-            return
+            file_input.close()
+            return None
 
         for line in file_input:
             self._parse_line(state, line)
         file_input.close()
 
-        self._update_coverage_data(state, coverage_data)
-
         for header, line in state.excluding:
             sys.stderr.write("(WARNING) The coverage exclusion region start "
                              "flag %s_EXCL_START\n\ton line %d did not have "
                              "corresponding %s_EXCL_STOP flag\n\t in file %s."
                              "\n" % (header, line, header, state.filename))
+        return state
+
+    def parse(self, filename, coverage_data):
+        state = self.parse_file(filename)
+        if state is not None:
+            self.update_coverage_data(state, coverage_data)
+
+
+def gcov_file_group(fname, gcov_filter, gcov_exclude, verbose=False,
+                    working_dir=None):
+    """Return the group ('active', 'filter' or 'exclude') of the gcov file
+    FNAME, which is relative to WORKING_DIR (see find_gcov_files())."""
+    if working_dir is None:
+        working_dir = os.getcwd()
+    absolute_path = os.path.normpath(os.path.join(working_dir, fname))
+    if not gcov_filter.match(fname):
+        if verbose:
+            sys.stdout.write("Filtering gcov file %s\n" % fname)
+        return 'filter'
+
+    filtered_fname = gcov_filter.sub('', fname)
+    for current_exclude in gcov_exclude:
+        if current_exclude.match(filtered_fname) or \
+                current_exclude.match(fname) or \
+                current_exclude.match(absolute_path):
+            if verbose:
+                sys.stdout.write("Excluding gcov file %s\n" % fname)
+            return 'exclude'
+    return 'active'
 
 
-def find_gcov_files(gcov_filter, gcov_exclude, gcov_stdout, verbose=False):
+def find_gcov_files(gcov_filter, gcov_exclude, gcov_stdout, verbose=False,
+                    working_dir=None):
+    """Sort the files that gcov reports creating into 'active', 'filter' and
+    'exclude' groups.  The names are relative to WORKING_DIR (the directory
+    gcov was run in), which defaults to the current directory."""
+    if working_dir is None:
+        working_dir = os.getcwd()
     gcov_files = {'active': [], 'filter': [], 'exclude': []}
     for line in gcov_stdout.splitlines():
         found = output_re.search(line.strip())
         if found is not None:
             fname = found.group(1)
-            if not gcov_filter.match(fname):
-                if verbose:
-                    sys.stdout.write("Filtering gcov file %s\n" % fname)
-                gcov_files['filter'].append(fname)
-                continue
-            exclude = False
-
-            for i in range(0, len(gcov_exclude)):
-                current_exclude = gcov_exclude[i]
-                filtered_fname = gcov_filter.sub('', fname)
-                exclude = exclude or current_exclude.match(filtered_fname)
-                exclude = exclude or current_exclude.match(fname)
-                absolute_path = os.path.abspath(fname)
-                exclude = exclude or current_exclude.match(absolute_path)
-                if exclude:
-                    break
-
-            if not exclude:
-                gcov_files['active'].append(fname)
-            elif verbose:
-                sys.stdout.write("Excluding gcov file %s\n" % fname)
-                gcov_files['exclude'].append(fname)
+            group = gcov_file_group(fname, gcov_filter, gcov_exclude, verbose,
+                                    working_dir)
+            gcov_files[group].append(
+                os.path.normpath(os.path.join(working_dir, fname)))
 
     return gcov_files
 
 
+def split_gcov_output(gcov_stdout):
+    """Split the output of gcov --stdout (bytes) into the gcov files it
+    contains, yielding the content of each of them.  gcov names no files
+    in this output; the source file is named by the header of each."""
+    content = []
+    for line in gcov_stdout.splitlines(True):
+        if stdout_source_re.match(line) is not None and content:
+            yield b''.join(content)
+            content = []
+        content.append(line)
+    if content:
+        yield b''.join(content)
+
+
 def find_potential_wd(objdir, abs_filename, verbose=False):
     """Try to identify possible working directories based on the objects in
     OBJDIR for coverage data in ABS_FILENAME."""
@@ -575,8 +670,33 @@ def find_potential_wd(objdir, abs_filename, verbose=False):
     return potential_wd
 
 
+#
+# Whether each gcov executable can write its output to stdout (-t/--stdout,
+# in newer versions) instead of into the directory it runs in.  This is
+# checked once per executable, from its help text.
+#
+_gcov_stdout_cache = {}
+
+
+def gcov_supports_stdout(gcov_cmd, env=None):
+    try:
+        return _gcov_stdout_cache[gcov_cmd]
+    except KeyError:
+        try:
+            gcov_process = subprocess.Popen([gcov_cmd, "--help"], env=env,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+            (out, err) = gcov_process.communicate()
+            supported = b"--stdout" in out
+        except OSError:
+            supported = False
+        _gcov_stdout_cache[gcov_cmd] = supported
+        return supported
+
+
 class Gcov(object):
-    def __init__(self, gcov_cmd, abs_filename, object_dir=None, verbose=False):
+    def __init__(self, gcov_cmd, abs_filename, object_dir=None, verbose=False,
+                 stdout=True):
         (dirname, self.filename) = os.path.split(abs_filename)
         if object_dir is not None:
             dirname = object_dir
@@ -590,31 +710,57 @@ class Gcov(object):
         self.env = dict(os.environ)
         self.env['LC_ALL'] = 'en_US'
 
-    def execute(self):
+        # With --stdout (if STDOUT allows it), gcov leaves the working
+        # directory alone, and the output (which is returned as bytes) holds
+        # the gcov files
+        self.stdout = stdout and gcov_supports_stdout(gcov_cmd, self.env)
+        if self.stdout:
+            self.cmd.append("--stdout")
+
+    def log(self, working_dir):
         if self.verbose:
             sys.stdout.write("Running gcov: '%s' in '%s'\n"
-                             % (' '.join(self.cmd), os.getcwd()))
-        gcov_process = subprocess.Popen(self.cmd, env=self.env,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-        (out, err) = gcov_process.communicate()
-        if gcov_process.returncode != 0:
+                             % (' '.join(self.cmd),
+                                working_dir or os.getcwd()))
+
+    def check_result(self, returncode, out, err):
+        if not self.stdout:
+            out = out.decode('utf-8')
+        err = err.decode('utf-8')
+        if returncode != 0:
             error_msg = ["(ERROR) GCOV returned %d on file %s!"
-                         % (gcov_process.returncode, self.filename),
+                         % (returncode, self.filename),
                          "\n    ".join(["GCOV says:"] + err.split('\n'))]
             error_msg = "\n".join(error_msg)
             raise GcovError(error_msg, self.filename)
 
-        return (out.decode('utf-8'), err.decode('utf-8'))
+        return (out, err)
+
+    def execute(self, working_dir=None):
+        self.log(working_dir)
+        gcov_process = subprocess.Popen(self.cmd, env=self.env,
+                                        cwd=working_dir,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        (out, err) = gcov_process.communicate()
+        return self.check_result(gcov_process.returncode, out, err)
 
 
-def link_datafile(filename, gcov_prefix, gcov_strip):
+def relocate_datafile(filename, gcov_prefix, gcov_strip,
+                      path_exists=os.path.exists):
+    """Return the path in the object tree (where gcov expects to find it) of
+    the data file FILENAME that was written under the GCOV_PREFIX."""
     head, prefix, datafile = gcov_prefix_split(filename, gcov_prefix,
-                                               gcov_strip)
-    filename = os.path.abspath(filename)
-    link = os.path.abspath(os.path.join(head, datafile))
-    os.symlink(filename, link)
-    return filename, link
+                                               gcov_strip, path_exists)
+    return os.path.abspath(os.path.join(head, datafile))
+
+
+def _link_or_copy(source, dest):
+    try:
+        os.symlink(source, dest)
+    except (AttributeError, OSError):
+        # No symbolic links (e.g. on Windows)
+        shutil.copyfile(source, dest)
 
 
 # Process a datafile (generated by running the instrumented application)
@@ -641,49 +787,104 @@ def link_datafile(filename, gcov_prefix, gcov_strip):
 # identifying the original gcc working directory (there is a bit of
 # trial-and-error here)
 #
-def process_datafile(filename, covdata, options):
-    #
-    # Launch gcov
-    #
-    real_filename = None
-    abs_filename = os.path.abspath(filename)
-    if is_gcda(abs_filename) and options.gcov_prefix:
-        real_filename, abs_filename = link_datafile(filename,
-                                                    options.gcov_prefix,
-                                                    options.gcov_prefix_strip)
-
-    errors = []
-    Done = False
-
-    gcov = Gcov(options.gcov_cmd, abs_filename, options.objdir,
-                options.verbose)
-
-    potential_wd = find_potential_wd(options.objdir, abs_filename,
-                                     options.verbose)
-    while len(potential_wd) > 0 and not Done:
-        # NB: either len(potential_wd) == 1, or all entries are absolute
-        # paths, so we don't have to chdir(starting_dir) at every
-        # iteration.
-        os.chdir(potential_wd.pop(0))
+class GcovJob(object):
+    """The work of running gcov on the datafile FILENAME: the candidate
+    working directories that remain to be tried, and the errors gcov has
+    reported so far.  The directory to run gcov in next is WD.
+
+    The gcov files are written into a private directory for the job under
+    SCRATCH, so that the job owns the files it hands on to the parser, and
+    jobs never see each other's files.  When gcov supports --stdout, they
+    are split from its output, which leaves the working directory alone.
+    That output does not name the gcov files, so it is only used when no
+    name is needed: without --keep, --gcov-filter and --gcov-exclude (the
+    source path is recorded in the files themselves).  Otherwise gcov
+    writes the files into the directory it runs in, where the next run in
+    that directory would overwrite them (two translation units that include
+    the same header produce the same gcov file), and the files it reports
+    creating are moved out as soon as gcov has finished.  With --keep, they
+    are copied instead, and left in the working directory.
+
+    Data files written under --gcov-prefix are relocated with the directory
+    probe PATH_EXISTS (see gcov_prefix_split())."""
+
+    def __init__(self, filename, options, scratch, path_exists=os.path.exists):
+        self.filename = filename
+        self.options = options
+        self.scratch = scratch
+        self.real_filename = None
+        self.abs_filename = os.path.abspath(filename)
+        self.object_dir = None
+        gcov_input = self.abs_filename
+        gcov_object_dir = options.objdir
+        if is_gcda(self.abs_filename) and options.gcov_prefix:
+            # Data files written under the GCOV_PREFIX are mapped back
+            # to their place in the object tree (ABS_FILENAME) in memory
+            self.real_filename = self.abs_filename
+            self.abs_filename = relocate_datafile(filename,
+                                                  options.gcov_prefix,
+                                                  options.gcov_prefix_strip,
+                                                  path_exists)
+            gcov_input = self._gather_datafiles()
+            gcov_object_dir = self.object_dir
+
+        self.errors = []
+        self.active_files = None
+
+        self.gcov = Gcov(options.gcov_cmd, gcov_input, gcov_object_dir,
+                         options.verbose,
+                         stdout=not (options.keep or options.gcov_exclude or
+                                     options.gcov_filter.pattern))
+
+        # The size of the coverage files, and the time spent running gcov,
+        # are used to schedule the most expensive data files first
+        self.size = 0
+        for fname in (self.real_filename or self.abs_filename,
+                      os.path.splitext(self.abs_filename)[0] + '.gcno'):
+            if os.path.exists(fname):
+                self.size += os.path.getsize(fname)
+        self.duration = 0.0
+        self.cost = 0.0
 
-        (out, err) = gcov.execute()
+        # NB: either len(potential_wd) == 1, or all entries are absolute
+        # paths, so gcov can be run in each directory in turn.
+        self.potential_wd = [
+            os.path.abspath(wd) for wd in
+            find_potential_wd(options.objdir, self.abs_filename,
+                              options.verbose)]
+        self.wd = None
+        self._next_wd()
+
+    def _next_wd(self):
+        if self.potential_wd:
+            self.wd = self.potential_wd.pop(0)
+        else:
+            self.wd = None
+
+    def process_output(self, out, err):
+        """Process the output of running gcov in WD.  Returns True if gcov
+        must be run again (in the next candidate working directory)."""
+        options = self.options
+        if self.gcov.stdout:
+            if source_re.search(err):
+                self.errors.append(err)
+                self._next_wd()
+            else:
+                self.active_files = self._write_output(out)
+                self.wd = None
+            return self.wd is not None
 
         # find the files that gcov created
         gcov_files = find_gcov_files(options.gcov_filter, options.gcov_exclude,
-                                     out, options.verbose)
+                                     out, options.verbose, self.wd)
 
         if source_re.search(err):
             # gcov tossed errors: try the next potential_wd
-            errors.append(err)
+            self.errors.append(err)
+            self._next_wd()
         else:
-            # Process *.gcov files
-            gcov_parser = GcovParser(options.root_dir, options.filter,
-                                     options.root_filter, options.exclude,
-                                     options.exclude_unreachable_branches,
-                                     options.verbose)
-            for fname in gcov_files['active']:
-                gcov_parser.parse(fname, covdata)
-            Done = True
+            self.active_files = self._collect(gcov_files.pop('active'))
+            self.wd = None
 
         if not options.keep:
             for group in gcov_files.values():
@@ -692,29 +893,295 @@ def process_datafile(filename, covdata, options):
                         # Only remove files that actually exist.
                         os.remove(fname)
 
-    if real_filename:
-        os.remove(abs_filename)
-        abs_filename = real_filename
+        return self.wd is not None
+
+    def _gather_datafiles(self):
+        """gcov looks for the .gcda and .gcno files in the same (object)
+        directory.  Rather than linking the relocated .gcda file into the
+        object tree, which may be read-only or shared, link both into a
+        private object directory, which is passed to gcov explicitly."""
+        self.object_dir = tempfile.mkdtemp(prefix='obj-', dir=self.scratch)
+        base = os.path.splitext(os.path.basename(self.abs_filename))[0]
+        gcda = os.path.join(self.object_dir, base + '.gcda')
+        _link_or_copy(self.real_filename, gcda)
+        gcno = os.path.splitext(self.abs_filename)[0] + '.gcno'
+        if os.path.exists(gcno):
+            _link_or_copy(gcno, os.path.join(self.object_dir, base + '.gcno'))
+        return gcda
+
+    def _write_output(self, out):
+        """Write the gcov files in the output OUT of gcov --stdout into the
+        job's scratch directory, numbered in order, returning their paths."""
+        job_dir = tempfile.mkdtemp(prefix='job-', dir=self.scratch)
+        written = []
+        for content in split_gcov_output(out):
+            written.append(os.path.join(job_dir, '%d.gcov' % len(written)))
+            with open(written[-1], 'wb') as gcov_file:
+                gcov_file.write(content)
+        return written
+
+    def _collect(self, fnames):
+        """Move the gcov files FNAMES into the job's scratch directory (with
+        --keep, they are copied, leaving the originals in place)."""
+        if not fnames:
+            return fnames
+        job_dir = tempfile.mkdtemp(prefix='job-', dir=self.scratch)
+        collected = []
+        for fname in fnames:
+            dest = os.path.join(job_dir, os.path.basename(fname))
+            if self.options.keep:
+                shutil.copyfile(fname, dest)
+            else:
+                shutil.move(fname, dest)
+            collected.append(dest)
+        return collected
+
+    def finish(self):
+        """Clean up after the job, returning the list of gcov files that
+        should be parsed.  These are private to the job, and the caller is
+        responsible for removing them once they have been parsed."""
+        abs_filename = self.real_filename or self.abs_filename
+        if self.object_dir:
+            shutil.rmtree(self.object_dir, ignore_errors=True)
+
+        if self.options.delete:
+            if not abs_filename.endswith('gcno'):
+                os.remove(abs_filename)
+
+        if self.active_files is None:
+            sys.stderr.write(
+                "(WARNING) GCOV produced the following errors processing %s:"
+                "\n\t   %s"
+                "\t(gcovr could not infer a working directory that resolved "
+                "it.)\n"
+                % (self.filename, "\t   ".join(self.errors)))
+            return []
+        return self.active_files
+
+
+class GcovHistory(object):
+    """The time gcov took to process each data file in previous runs, which
+    is read from (and saved to) the sidecar file FILENAME, if given.  This
+    is used to estimate the cost of the gcov jobs, so that the longest jobs
+    can be started first.  For data files without a history, the cost is
+    estimated from the size of their coverage files."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.timings = {}
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as history:
+                    self.timings = self._validate(json.load(history))
+            except ValueError:
+                sys.stderr.write("(WARNING) Ignoring the corrupt gcov "
+                                 "history file %s\n" % filename)
+        # Seconds per byte, to put size-based estimates in the same units
+        total_size = sum([size for size, duration in self.timings.values()])
+        total_time = sum([duration for size, duration in
+                          self.timings.values()])
+        if total_size:
+            self.rate = float(total_time) / total_size
+        else:
+            self.rate = 1.0
+
+    def _validate(self, timings):
+        """Return the entries of TIMINGS (as loaded from the history file)
+        that map a data file to its [size, duration].  A file that holds
+        anything else raises ValueError, and bad entries are dropped."""
+        if not isinstance(timings, dict):
+            raise ValueError("not a JSON object")
+        valid = {}
+        for (filename, entry) in timings.items():
+            if isinstance(entry, list) and len(entry) == 2 and \
+                    all([isinstance(value, numbers.Real) and
+                         not isinstance(value, bool) and value >= 0
+                         for value in entry]):
+                valid[filename] = entry
+        if len(valid) < len(timings):
+            sys.stderr.write("(WARNING) Ignoring %d bad entries of the gcov "
+                             "history file %s\n"
+                             % (len(timings) - len(valid), self.filename))
+        return valid
+
+    def estimate(self, job):
+        if job.abs_filename in self.timings:
+            return self.timings[job.abs_filename][1]
+        return job.size * self.rate
+
+    def record(self, job):
+        self.timings[job.abs_filename] = [job.size, job.duration]
+
+    def save(self):
+        if self.filename:
+            with open(self.filename, 'w') as history:
+                json.dump(self.timings, history, indent=0, sort_keys=True)
+
+
+def run_gcov(filename, options, scratch, history=None,
+             path_exists=os.path.exists):
+    """Run gcov on the datafile FILENAME, trying each candidate working
+    directory in turn.  See GcovJob.finish() for the return value."""
+    job = GcovJob(filename, options, scratch, path_exists)
+    pending = job.wd is not None
+    while pending:
+        start = time.time()
+        (out, err) = job.gcov.execute(job.wd)
+        job.duration += time.time() - start
+        pending = job.process_output(out, err)
+    if history is not None:
+        history.record(job)
+    return job.finish()
+
+
+def parse_gcov_file(gcov_parser, fname):
+    """Parse the gcov file FNAME (a private copy, see GcovJob), returning
+    the parser state or None.  The file is removed afterwards."""
+    try:
+        return gcov_parser.parse_file(fname)
+    finally:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def get_gcov_parser(options):
+    return GcovParser(options.root_dir, options.filter, options.root_filter,
+                      options.exclude, options.exclude_unreachable_branches,
+                      options.verbose)
 
-    if options.delete:
-        if not abs_filename.endswith('gcno'):
-            os.remove(abs_filename)
 
-    if not Done:
-        sys.stderr.write(
-            "(WARNING) GCOV produced the following errors processing %s:\n"
-            "\t   %s"
-            "\t(gcovr could not infer a working directory that resolved it.)\n"
-            % (filename, "\t   ".join(errors)))
+def process_datafile(filename, covdata, options):
+    gcov_parser = get_gcov_parser(options)
+    scratch = tempfile.mkdtemp(prefix='gcovr-', dir=options.gcov_scratch_dir)
+    try:
+        for fname in run_gcov(filename, options, scratch):
+            state = parse_gcov_file(gcov_parser, fname)
+            if state is not None:
+                gcov_parser.update_coverage_data(state, covdata)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+#
+# The data files are processed by a pipeline of stages connected by
+# bounded queues:
+#
+#   datafiles --> run_gcov --> parse_gcov_file --> merge into covdata
+#
+# Each stage runs in its own thread, so gcov can start on the first data
+# files while the directory walk continues, and parsing overlaps with the
+# execution of gcov.  The queue depth bounds the amount of work (and
+# memory) in flight between the stages.
+#
+# A stage owns the files it emits: the gcov stage only hands on gcov files
+# that it has moved out of the gcc working directory (where the next run
+# of gcov would overwrite them), and the parse stage removes them.
+#
+pipeline_queue_depth = 64
+
+
+def _drain(q):
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        yield item
+
+
+def _each(func):
+    """A pipeline stage target that emits the results of FUNC(item) for
+    each of the items in turn."""
+    def target(items, emit):
+        for item in items:
+            for result in func(item):
+                emit(result)
+    return target
+
+
+class _PipelineStage(threading.Thread):
+    """Run TARGET(items, emit), where EMIT puts results on the OUTPUT queue.
+    The end of the stream is marked with a None item.  If an exception is
+    raised it is recorded and the remaining items are discarded, so that
+    the upstream stages do not block."""
+
+    def __init__(self, target, items, output):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.target = target
+        self.items = iter(items)
+        self.output = output
+        self.error = None
+
+    def emit(self, result):
+        if result is not None:
+            self.output.put(result)
+
+    def run(self):
+        try:
+            self.target(self.items, self.emit)
+        except Exception:
+            self.error = sys.exc_info()[1]
+            for item in self.items:
+                pass
+        finally:
+            self.output.put(None)
+
+
+def get_gcov_stage(options, history, scratch, path_exists):
+    """Return the pipeline stage target that runs gcov.  With more than one
+    job, the gcov processes are driven by an asyncio event loop, which keeps
+    up to options.jobs of them in flight (longest jobs first)."""
+    if options.jobs > 1:
+        try:
+            from .gcov_orchestrator import GcovOrchestrator
+        except (ImportError, SyntaxError):
+            # asyncio (and the async/await syntax) needs Python 3
+            sys.stderr.write("(WARNING) Running gcov in parallel requires "
+                             "Python 3.8 or newer; running one gcov at a "
+                             "time.\n")
+        else:
+            return GcovOrchestrator(options, history, scratch,
+                                    path_exists).run
+    return _each(lambda f: run_gcov(f, options, scratch, history,
+                                    path_exists))
 
 
 def process_files(datafiles, options):
-    start_dir = os.getcwd()
     covdata = {}
-    for file in datafiles:
-        process_datafile(file, covdata, options)
+    gcov_parser = get_gcov_parser(options)
+    history = GcovHistory(options.gcov_history)
+    path_exists = cached_path_exists()
+    # NB: --gcov-scratch-dir may point to a tmpfs (e.g. /dev/shm)
+    scratch = tempfile.mkdtemp(prefix='gcovr-', dir=options.gcov_scratch_dir)
+
+    datafile_queue = queue.Queue(pipeline_queue_depth)
+    gcov_queue = queue.Queue(pipeline_queue_depth)
+    state_queue = queue.Queue(pipeline_queue_depth)
+    stages = [
+        _PipelineStage(_each(lambda f: (f,)), datafiles, datafile_queue),
+        _PipelineStage(get_gcov_stage(options, history, scratch,
+                                      path_exists),
+                       _drain(datafile_queue), gcov_queue),
+        _PipelineStage(
+            _each(lambda f: (parse_gcov_file(gcov_parser, f),)),
+            _drain(gcov_queue), state_queue)]
+    try:
+        for stage in stages:
+            stage.start()
+
+        # The merge is the final stage; reporting needs the complete data.
+        for state in _drain(state_queue):
+            gcov_parser.update_coverage_data(state, covdata)
+
+        for stage in stages:
+            stage.join()
+            if stage.error is not None:
+                raise stage.error
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    history.save()
+
     if options.verbose:
         sys.stdout.write("".join(["Gathered coveraged data for ",
                                   str(len(covdata)), " files\n"]))
-    os.chdir(start_dir)
     return covdata
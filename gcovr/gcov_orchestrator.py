@@ -0,0 +1,150 @@
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+
+#
+# Run gcov on many data files at once from an asyncio event loop.
+#
+# NB: This module uses the async/await syntax, and the event loop runs in
+# a pipeline thread, where subprocesses can only be watched since Python
+# 3.8.  gcovr.data falls back to running one gcov at a time when the
+# import fails.
+#
+
+import asyncio
+import os
+import sys
+import time
+
+if sys.version_info < (3, 8):
+    raise ImportError("running gcov in parallel requires Python 3.8")
+
+from .data import GcovJob, gcov_supports_stdout, pipeline_queue_depth
+
+
+class GcovOrchestrator(object):
+    """Keep up to options.jobs gcov processes in flight.  The stdout and
+    stderr of every process are read concurrently by the event loop, so the
+    heavy lifting stays in the gcov child processes.  When gcov fails to
+    find the sources, the data file is rescheduled in its next candidate
+    working directory.
+
+    With --stdout, gcov writes nothing into the directory it runs in, and
+    any number of processes share a working directory (see GcovJob).  Older
+    versions of gcov write their output files into that directory, so two
+    of them are never run in the same working directory at once.
+
+    The pending jobs are started in order of decreasing estimated cost (see
+    GcovHistory), so that a few large translation units do not dominate the
+    tail of the run.  Up to pipeline_queue_depth data files are read ahead
+    to choose from."""
+
+    def __init__(self, options, history, scratch, path_exists=os.path.exists):
+        self.options = options
+        self.history = history
+        self.scratch = scratch
+        self.path_exists = path_exists
+        self.jobs = options.jobs
+
+    def run(self, datafiles, emit):
+        """The pipeline stage target: run gcov on each of the DATAFILES,
+        calling EMIT for each of the gcov files to be parsed."""
+        # gcov is probed for --stdout (see GcovJob) by running it, which
+        # would block the event loop; the result is cached from here on.
+        gcov_supports_stdout(self.options.gcov_cmd)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._orchestrate(loop, datafiles, emit))
+        finally:
+            loop.close()
+
+    async def _execute(self, job):
+        job.gcov.log(job.wd)
+        start = time.time()
+        process = await asyncio.create_subprocess_exec(
+            *job.gcov.cmd, env=job.gcov.env, cwd=job.wd,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            (out, err) = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        job.duration += time.time() - start
+        return job.gcov.check_result(process.returncode, out, err)
+
+    async def _orchestrate(self, loop, datafiles, emit):
+        datafiles = iter(datafiles)
+        pending = []
+        running = {}
+        busy = set()
+        fetch = None
+        exhausted = False
+        try:
+            while True:
+                # The (blocking) pipeline queues are read in the executor.
+                if fetch is None and not exhausted and \
+                        len(pending) < pipeline_queue_depth:
+                    fetch = loop.run_in_executor(None, next, datafiles, None)
+
+                pending.sort(key=lambda job: job.cost, reverse=True)
+                for job in list(pending):
+                    if len(running) >= self.jobs:
+                        break
+                    if not job.gcov.stdout:
+                        if job.wd in busy:
+                            continue
+                        busy.add(job.wd)
+                    pending.remove(job)
+                    running[asyncio.ensure_future(self._execute(job))] = job
+
+                waiting = set(running)
+                if fetch is not None:
+                    waiting.add(fetch)
+                if not waiting:
+                    break
+                done, _ = await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task is fetch:
+                        fetch = None
+                        filename = task.result()
+                        if filename is None:
+                            exhausted = True
+                            continue
+                        job = GcovJob(filename, self.options, self.scratch,
+                                      self.path_exists)
+                        job.cost = self.history.estimate(job)
+                        if job.wd is None:
+                            await self._finish(loop, job, emit)
+                        else:
+                            pending.append(job)
+                        continue
+
+                    job = running.pop(task)
+                    if not job.gcov.stdout:
+                        busy.discard(job.wd)
+                    (out, err) = task.result()
+                    if job.process_output(out, err):
+                        # reschedule in the next candidate working directory
+                        pending.append(job)
+                    else:
+                        await self._finish(loop, job, emit)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(list(running))
+            if fetch is not None:
+                await fetch
+
+    async def _finish(self, loop, job, emit):
+        self.history.record(job)
+        for fname in job.finish():
+            await loop.run_in_executor(None, emit, fname)
@@ -9,17 +9,22 @@
 #  _________________________________________________________________________
 
 from .version import version_str
+from .utils import open_output, close_output, is_compressed
 
-try:
-    import html
-except:
-    import cgi as html
-
+import errno
+import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
 import os
+import re
 import sys
 import time
 import shutil
 import datetime
+import tempfile
 import posixpath
 
 medium_coverage = 75.0
@@ -30,39 +35,527 @@ high_color = "success"
 covered_color = "covered"
 uncovered_color = "uncovered"
 
-from jinja2 import Environment, PackageLoader, Template
-
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
 
-env = Environment(loader=PackageLoader('gcovr'))
 
 #
-# A string template for the root HTML output
+# The template environments, by --cache-dir (None without one).  The
+# templates do not change while the reports are printed.
 #
-root_page = env.get_template('index.html')
+environments = {}
+
+
+def get_environment(options):
+    cache_dir = getattr(options, 'cache_dir', None)
+    env = environments.get(cache_dir)
+    if env is None:
+        env = Environment(loader=PackageLoader('gcovr'), auto_reload=False)
+        if cache_dir is not None:
+            directory = os.path.join(cache_dir, 'jinja')
+            makedirs(directory)
+            env.bytecode_cache = FileSystemBytecodeCache(directory)
+        environments[cache_dir] = env
+    return env
+
 
 #
-# A string template for the source file HTML output
+# The template NAME: index.html for the index pages, index_json.html for
+# the index pages whose rows are rendered by the browser (see
+# --html-index), or source.html for the detail pages.  The templates are
+# only compiled when a report is printed, and with a --cache-dir, jinja
+# keeps them compiled there for the next runs.
 #
-source_page = env.get_template('source.html')
+def get_template(name, options):
+    return get_environment(options).get_template(name)
 
 
 def makedirs(path):
     try:
         os.makedirs(path)
     except OSError as err:
-        if err.errno == os.errno.EEXIST and os.path.isdir(path):
-            pass
+        if err.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
 
 
 def copy_static_content(options):
     from pkg_resources import resource_filename
 
-    css_path = os.path.join(os.path.dirname(options.output), 'css')
+    output_dir = os.path.dirname(options.output)
+    cache_dir = getattr(options, 'cache_dir', None)
+    for subdir in ('css', 'fonts', 'js'):
+        resource = resource_filename(__name__, 'static/' + subdir)
+        makedirs(os.path.join(output_dir, subdir))
+        for file in os.listdir(resource):
+            with open(os.path.join(resource, file), 'rb') as f:
+                content = f.read()
+            dest = os.path.join(output_dir, subdir, file)
+            install_static_file(content, dest, cache_dir)
+            if precompress_pages(options):
+                install_static_file(gzip_bytes(content), dest + '.gz',
+                                    cache_dir)
+
+
+#
+# Write the CONTENT of a static file to DEST, unless it is already there.
+# With a CACHE_DIR, the content is kept once in its static directory, and
+# DEST is a hard link to it, so that the reports share their static files.
+#
+def install_static_file(content, dest, cache_dir):
+    if cache_dir is None:
+        if os.path.exists(dest):
+            with open(dest, 'rb') as f:
+                if f.read() == content:
+                    return
+        write_file(content, dest)
+        return
+
+    key = hashlib.sha1(content).hexdigest()
+    stored = os.path.join(cache_dir, 'static', key[:2], key)
+    if not os.path.exists(stored):
+        makedirs(os.path.dirname(stored))
+        write_file(content, stored)
+    if os.path.exists(dest) and os.path.samefile(stored, dest):
+        return
+    # The link is made next to DEST, then renamed over it
+    tmp = dest + '.tmp%d' % os.getpid()
+    try:
+        os.link(stored, tmp)
+    except (AttributeError, OSError):
+        # No hard links on this platform or file system
+        write_file(content, dest)
+        return
+    replace_file(tmp, dest)
+
+
+#
+# Write CONTENT to a temporary file, then rename it to FILENAME, which
+# replaces FILENAME (and not the files it may be linked to) at once
+#
+def write_file(content, filename):
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    replace_file(tmp, filename)
+
+
+def replace_file(tmp, filename):
+    try:
+        os.rename(tmp, filename)
+    except OSError:
+        # Windows does not rename over an existing file
+        os.remove(filename)
+        os.rename(tmp, filename)
+
+
+#
+# The gzip-compressed CONTENT, the same for the same content
+#
+def gzip_bytes(content):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    f.write(content)
+    f.close()
+    return buf.getvalue()
+
+
+#
+# Whether every page is written along with a compressed copy (with
+# --html-precompress)
+#
+def precompress_pages(options):
+    return getattr(options, 'html_precompress', False)
+
+
+class PageLayout(object):
+    """The files of the pages of a report, which are named after its OUTPUT
+    file (the main index page).  The flat layout puts every page next to
+    OUTPUT, with the path of its source file in its name, and links the
+    pages by their absolute paths.  The SHARDED layout spreads the pages
+    over 256 subdirectories of a directory named after OUTPUT, by the hash
+    of the path of the source file, with names of bounded length, and links
+    the pages relatively.  The pages of a compressed report end in .gz."""
+
+    def __init__(self, output, sharded=False):
+        self.output = os.path.abspath(output)
+        self.sharded = sharded
+        self.suffix = ''
+        self.base = self.output
+        if self.base.endswith('.gz'):
+            (self.base, self.suffix) = (self.base[:-3], '.gz')
+
+    def filename(self, name):
+        if self.sharded:
+            (root, ext) = os.path.splitext(self.base)
+            key = name
+            if not isinstance(key, bytes):
+                key = key.encode('utf-8')
+            key = hashlib.sha1(key).hexdigest()
+            short = unsafe_chars.sub('_', os.path.basename(name))[:64]
+            return os.path.join(root, key[:2], '%s.%s%s%s' % (
+                key[2:18], short, ext or '.html', self.suffix))
+        ttmp = self.base.split('.')
+        if len(ttmp) > 1:
+            return ('.'.join(ttmp[:-1]) + '.' + name.replace('/', '_') +
+                    '.' + ttmp[-1] + self.suffix)
+        else:
+            return (ttmp[0] + '.' + name.replace('/', '_') + '.html' +
+                    self.suffix)
+
+    def link(self, target, page):
+        """The link to the page TARGET from the page PAGE"""
+        if not self.sharded:
+            return target
+        target = os.path.relpath(target, os.path.dirname(page))
+        return target.replace(os.sep, '/')
+
+    def root(self, page):
+        """The prefix of the links from PAGE to the static content"""
+        return page_root(page, self.output)
+
+
+unsafe_chars = re.compile(r'[^A-Za-z0-9._+-]')
+
+
+def page_root(page, output):
+    root = os.path.relpath(os.path.dirname(os.path.abspath(output)),
+                           os.path.dirname(os.path.abspath(page)))
+    if root == os.curdir:
+        return ''
+    return root.replace(os.sep, '/') + '/'
+
+
+class HtmlManifest(object):
+    """The hashes of the inputs of the pages written to DIRECTORY by previous
+    runs, which are read from (and saved to) the manifest file there.  The
+    pages whose inputs did not change are not written again.  Without a
+    DIRECTORY, every page is written.
+
+    The pages to be written are dropped from the manifest when it is saved
+    before writing them, and only added back by commit() afterwards, so
+    that an interrupted run cannot leave stale pages behind.  The pages
+    that a run no longer writes are removed by prune()."""
+
+    def __init__(self, directory=None):
+        self.filename = None
+        self.digests = {}
+        self.pending = {}
+        if directory is not None:
+            self.filename = os.path.join(directory, 'gcovr-manifest.json')
+        if self.filename and os.path.exists(self.filename):
+            try:
+                with open(self.filename) as manifest:
+                    self.digests = json.load(manifest)
+            except ValueError:
+                sys.stderr.write("(WARNING) Ignoring the corrupt manifest "
+                                 "file %s\n" % self.filename)
+
+    def changed(self, page, digest):
+        if self.filename is None:
+            return True
+        name = os.path.relpath(page, os.path.dirname(self.filename))
+        if self.digests.get(name) == digest and os.path.exists(page):
+            return False
+        self.digests.pop(name, None)
+        self.pending[name] = digest
+        return True
+
+    def prune(self, pages):
+        """Remove the pages of the manifest that are not in PAGES (those of
+        the current run), with their chunk pages and compressed copies.
+        Returns True if any were removed."""
+        directory = os.path.dirname(self.filename)
+        names = set([os.path.relpath(page, directory) for page in pages])
+        stale = [name for name in self.digests if name not in names]
+        for name in stale:
+            del self.digests[name]
+            (root, ext) = os.path.splitext(os.path.join(directory, name))
+            chunk_re = re.compile(re.escape(root) + r'\.\d+' + re.escape(ext))
+            for page in [root + ext] + [
+                    page for page in glob.glob(root + '.*' + ext)
+                    if chunk_re.match(page)]:
+                for filename in (page, page + '.gz'):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+        return len(stale) > 0
+
+    def save(self):
+        if self.filename is None:
+            return
+        with open(self.filename, 'w') as manifest:
+            json.dump(self.digests, manifest, indent=0, sort_keys=True)
+
+    def commit(self):
+        if self.pending:
+            self.digests.update(self.pending)
+            self.pending = {}
+            self.save()
+
+
+#
+# The hash of the templates and of the gcovr and pygments versions, which
+# is part of the inputs of every page
+#
+def template_digest(options):
+    env = get_environment(options)
+    digest = hashlib.sha1(('%s\0%s' % (version_str(), pygments_version))
+                          .encode('utf-8'))
+    for name in sorted(env.list_templates()):
+        digest.update(env.loader.get_source(env, name)[0].encode('utf-8'))
+    return digest.hexdigest()
+
+
+#
+# The hash of the inputs of an index page: the templates, and the DATA the
+# page is rendered from, but for the time it was generated (or the content
+# of a script)
+#
+def index_page_digest(filename, data, templates, options):
+    digest = hashlib.sha1(templates.encode('utf-8'))
+    digest.update(repr((is_compressed(filename, options),
+                        precompress_pages(options),
+                        getattr(options, 'html_index', 'table'),
+                        options.sort_uncovered, options.sort_percent,
+                        options.show_branch)).encode('utf-8'))
+    if isinstance(data, dict):
+        data = json.dumps(dict((key, value) for (key, value) in data.items()
+                               if key not in ('TIME', 'DATE')),
+                          sort_keys=True)
+    digest.update(data.encode('utf-8'))
+    return digest.hexdigest()
+
+
+#
+# The hash of the inputs of the detail page of CDATA: the templates, the
+# coverage data, the source code and the lexer that highlights it.
+#
+def source_page_digest(cdata, templates, options):
+    digest = hashlib.sha1(templates.encode('utf-8'))
+    digest.update(repr((
+        cdata._filename,
+        get_lexer(cdata._filename, options).name,
+        is_compressed(cdata._sourcefile, options),
+        precompress_pages(options),
+        getattr(options, 'html_chunk_lines', 0),
+        sorted(cdata.all_lines),
+        sorted(cdata.covered.items()),
+        sorted(cdata.uncovered),
+        sorted([(line, sorted(branches.items()))
+                for (line, branches) in cdata.branches.items()]))
+        ).encode('utf-8'))
+    with open(os.path.join(options.root_dir, cdata._filename), 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+#
+# The function of a file and its statistics that selects the files whose
+# detail pages are written: the files whose line coverage is below the
+# --html-details-below percentage, and the files named by the
+# --html-details-for file.  Without either option, every file is selected.
+#
+def details_selector(options):
+    threshold = getattr(options, 'html_details_below', None)
+    listed = getattr(options, 'html_details_for', None)
+    if threshold is None and listed is None:
+        return lambda f, stats: True
+    # The listed paths, by file name
+    names = {}
+    if listed is not None:
+        for path in read_paths(listed):
+            path = os.path.normpath(path)
+            names.setdefault(os.path.basename(path), []).append(path)
+
+    def selected(f, stats):
+        (hits, lines) = stats[:2]
+        if threshold is not None and \
+                (100.0 * hits / lines if lines else 100.0) < threshold:
+            return True
+        for path in names.get(os.path.basename(f), ()):
+            if f == path or f.endswith(os.sep + path):
+                return True
+        return False
+    return selected
+
+
+#
+# The paths in FILENAME: one per line, or the new files of a unified diff
+# (as from 'git diff')
+#
+def read_paths(filename):
+    with open(filename) as f:
+        lines = [line.rstrip('\r\n') for line in f]
+    diff = [line[4:].split('\t')[0] for line in lines
+            if line.startswith('+++ ')]
+    if not diff:
+        return [line.strip() for line in lines if line.strip()]
+    paths = []
+    for path in diff:
+        if path == '/dev/null':
+            continue
+        if path.startswith('b/'):
+            path = path[2:]
+        paths.append(path)
+    return paths
+
+
+class SearchIndex(object):
+    """The paths of the files of a report, with the link to their pages, and
+    the trigram index of the paths, which is searched by the search box of
+    the index pages (with --html-search).  The trigrams of the lower case
+    paths map to the increasing numbers of the files, which are written as
+    the differences between the numbers."""
+
+    def __init__(self):
+        self.files = []
+        self.trigrams = {}
+
+    def add(self, path, link):
+        number = len(self.files)
+        self.files.append([path, link])
+        path = path.lower()
+        for trigram in set(path[i:i + 3] for i in range(len(path) - 2)):
+            self.trigrams.setdefault(trigram, []).append(number)
+
+    def script(self):
+        trigrams = {}
+        for (trigram, numbers) in self.trigrams.items():
+            trigrams[trigram] = [numbers[0]] + [
+                numbers[i] - numbers[i - 1] for i in range(1, len(numbers))]
+        return 'var GCOVR_SEARCH = %s;' % json.dumps(
+            {'files': self.files, 'trigrams': trigrams},
+            separators=(',', ':'), sort_keys=True)
+
+
+#
+# The [line hits, lines, branch hits, branches] of a single file
+#
+def file_stats(cdata):
+    class_lines = 0
+    class_hits = 0
+    class_branches = 0
+    class_branch_hits = 0
+    for line in cdata.all_lines:
+        hits = cdata.covered.get(line, 0)
+        class_lines += 1
+        if hits > 0:
+            class_hits += 1
+        branches = cdata.branches.get(line)
+        if branches is not None:
+            for v in branches.values():
+                if v > 0:
+                    class_branch_hits += 1
+            class_branches += len(branches)
+    return [class_hits, class_lines, class_branch_hits, class_branches]
+
+
+#
+# Aggregate the STATS of the files KEYS into the directories containing
+# them, up to ROOT, in a single pass.  Returns a dictionary mapping every
+# directory to its [subdirectories, files, stats].
+#
+def directory_tree(keys, covdata, stats, root):
+    tree = {root: [set(), [], [0, 0, 0, 0]]}
+    for f in keys:
+        path = os.path.dirname(covdata[f]._filename)
+        tree.setdefault(path, [set(), [], [0, 0, 0, 0]])[1].append(f)
+        child = None
+        while True:
+            node = tree.setdefault(path, [set(), [], [0, 0, 0, 0]])
+            if child is not None:
+                node[0].add(child)
+            totals = node[2]
+            for i in range(4):
+                totals[i] += stats[f][i]
+            if path == root:
+                break
+            (child, path) = (path, os.path.dirname(path))
+            if path == child:
+                # Outside of the root directory (an absolute path)
+                path = root
+    return tree
+
+
+#
+# The rows of the index page of the directory PATH: its subdirectories,
+# then its files (in the order of the report)
+#
+def directory_rows(path, subdirs, subfiles, tree, covdata, stats, layout,
+                   page, options):
+    directory = path and path.rstrip(os.sep) + os.sep or ''
+    row = index_row(options)
+    rows = []
+    for subdir in sorted(subdirs):
+        subpage = layout.filename(os.path.join(subdir, 'index'))
+        rows.append(row(True, layout.link(subpage, page),
+                        directory, subdir.rstrip(os.sep) + os.sep,
+                        tree[subdir][2]))
+    for f in subfiles:
+        cdata = covdata[f]
+        rows.append(row(cdata._linked,
+                        layout.link(cdata._sourcefile, page),
+                        directory, cdata._filename, stats[f]))
+    return rows
 
-    resource = resource_filename(__name__, 'static/css')
-    makedirs(css_path)
-    for file in os.listdir(resource):
-        shutil.copy(os.path.join(resource, file), css_path)
+
+def stats_row(details, page, directory, filename, stats):
+    (hits, lines, branch_hits, branches) = stats
+    return html_row(details, page,
+                    directory=directory,
+                    filename=filename,
+                    LinesExec=hits,
+                    LinesTotal=lines,
+                    LinesCoverage=(100.0 * hits / lines
+                                   if lines else 100.0),
+                    BranchesExec=branch_hits,
+                    BranchesTotal=branches,
+                    BranchesCoverage=(100.0 * branch_hits / branches
+                                      if branches else 100.0))
+
+
+#
+# The row of FILENAME for an index page rendered by the browser: its name
+# (relative to DIRECTORY), the link to its PAGE (or None), and its STATS
+#
+def json_row(details, page, directory, filename, stats):
+    return [filename[len(directory):], page if details else None] + \
+        list(stats)
+
+
+def index_row(options):
+    if getattr(options, 'html_index', 'table') == 'json':
+        return json_row
+    return stats_row
+
+
+#
+# Render the index page from DATA, as a table or (with --html-index=json)
+# as the JSON rows and the script that renders them
+#
+def render_index(data, options):
+    if getattr(options, 'html_index', 'table') != 'json':
+        return get_template('index.html', options).render(**data)
+    data = dict(data)
+    data['ROWS_JSON'] = json.dumps(
+        data['ROWS'], separators=(',', ':')).replace('</', '<\\/')
+    data['SORT'] = (options.sort_uncovered and 'uncovered' or
+                    options.sort_percent and 'percent' or 'name')
+    data['METRIC'] = options.show_branch and 'branches' or 'lines'
+    return get_template('index_json.html', options).render(**data)
+
+
+#
+# Set the line and branch summary of an index page from its STATS
+#
+def set_summary(data, stats):
+    (hits, lines, branch_hits, branches) = stats
+    for (prefix, covered, total) in (('LINES', hits, lines),
+                                     ('BRANCHES', branch_hits, branches)):
+        coverage = 0.0 if total == 0 else round(100.0 * covered / total, 1)
+        data[prefix + '_EXEC'] = str(covered)
+        data[prefix + '_TOTAL'] = str(total)
+        data[prefix + '_COVERAGE'] = str(coverage)
+        data[prefix + '_COLOR'] = coverage_color(coverage)
 
 
 def coverage_info(covdata, show_branch):
@@ -108,6 +601,11 @@ def print_html_report(covdata, options):
         options.output = os.path.join(options.output, u"index.html")
 
     copy_static_content(options)
+    if getattr(options, 'html_incremental', False):
+        manifest = HtmlManifest(
+            os.path.dirname(os.path.abspath(options.output)))
+    else:
+        manifest = HtmlManifest()
 
     data = {}
     data['HEAD'] = "Head"
@@ -139,26 +637,25 @@ def print_html_report(covdata, options):
     # Generate the coverage output (on a per-package basis)
     files = []
     keys = list(covdata.keys())
-    sort_uncovered = options.sort_uncovered and _num_uncovered
-    sort_percent = options.sort_percent and _percent_uncovered
-    keys.sort(key=sort_uncovered or sort_percent or _alpha)
+    if getattr(options, 'html_index', 'table') == 'json':
+        # The browser sorts the rows
+        keys.sort()
+    else:
+        sort_uncovered = options.sort_uncovered and _num_uncovered
+        sort_percent = options.sort_percent and _percent_uncovered
+        keys.sort(key=sort_uncovered or sort_percent or _alpha)
 
     filtered_fname = None
 
+    layout = PageLayout(options.output,
+                        getattr(options, 'html_layout', 'flat') == 'sharded')
+
     for f in keys:
         cdata = covdata[f]
         filtered_fname = options.root_filter.sub('', f)
-        print filtered_fname
         files.append(filtered_fname)
         cdata._filename = filtered_fname
-        ttmp = os.path.abspath(options.output).split('.')
-        if len(ttmp) > 1:
-            cdata._sourcefile = ('.'.join(ttmp[:-1]) + '.' +
-                                 cdata._filename.replace('/', '_') + '.' +
-                                 ttmp[-1])
-        else:
-            cdata._sourcefile = (ttmp[0] + '.' +
-                                 cdata._filename.replace('/', '_') + '.html')
+        cdata._sourcefile = layout.filename(cdata._filename)
     # Define the common root directory, which may differ from options.root
     # when source files share a common prefix.
     if len(files) > 1:
@@ -166,229 +663,508 @@ def print_html_report(covdata, options):
         if commondir != '':
             data['DIRECTORY'] = commondir
     else:
-        print filtered_fname
         dir_, file_ = os.path.split(filtered_fname)
         if dir_ != '':
             data['DIRECTORY'] = dir_ + os.sep
 
+    # The search index is built along with the statistics of the files
+    if getattr(options, 'html_search', False):
+        search = SearchIndex()
+    else:
+        search = None
+    # Only the detail pages of the selected files are written; the others
+    # are linked if they are left from a previous run.
+    selected = details_selector(options)
+    stats = {}
+    output_dir = os.path.dirname(layout.output)
     for f in keys:
         cdata = covdata[f]
-        class_lines = 0
-        class_hits = 0
-        class_branches = 0
-        class_branch_hits = 0
-        for line in cdata.all_lines:
-            hits = cdata.covered.get(line, 0)
-            class_lines += 1
-            if hits > 0:
-                class_hits += 1
-            branches = cdata.branches.get(line)
-            if branches is None:
-                pass
+        stats[f] = file_stats(cdata)
+        cdata._detailed = options.html_details and selected(f, stats[f])
+        cdata._linked = cdata._detailed or (
+            options.html_details and os.path.exists(cdata._sourcefile))
+        if search is not None:
+            link = None
+            if cdata._linked:
+                link = os.path.relpath(cdata._sourcefile, output_dir)
+                link = link.replace(os.sep, '/')
+            search.add(cdata._filename, link)
+
+    # Every page to be written, as (filename, HTML), and what it is rendered
+    # from (see index_page_digest()).  The scripts that the pages load are
+    # never compressed (but for their --html-precompress copies), as
+    # browsers only load them as they are.
+    pages = []
+    inputs = {}
+    scripts = set()
+    if search is not None:
+        filename = os.path.splitext(layout.base)[0] + '.search.js'
+        data['SEARCH'] = os.path.basename(filename)
+        pages.append((filename, search.script()))
+        inputs[filename] = pages[-1][1]
+        scripts.add(filename)
+    if getattr(options, 'html_tree', False):
+        # An index page for every directory, below the common directory
+        root = os.path.dirname(data['DIRECTORY'])
+        tree = directory_tree(keys, covdata, stats, root)
+        for (path, (subdirs, subfiles, totals)) in sorted(tree.items()):
+            if path == root:
+                filename = options.output
             else:
-                b_hits = 0
-                for v in branches.values():
-                    if v > 0:
-                        b_hits += 1
-                coverage = 100*b_hits/len(branches)
-                class_branch_hits += b_hits
-                class_branches += len(branches)
-
-        if class_lines == 0:
-            lines_covered = 100.0
-        else:
-            lines_covered = 100.0 * class_hits / class_lines
-        if class_branches == 0:
-            branches_covered = 100.0
-        else:
-            branches_covered = 100.0 * class_branch_hits / class_branches
+                filename = layout.filename(os.path.join(path, 'index'))
+            page = dict(data)
+            page['DIRECTORY'] = path and path + os.sep or "."
+            page['ROOT'] = layout.root(filename)
+            page['ROWS'] = directory_rows(path, subdirs, subfiles, tree,
+                                          covdata, stats, layout, filename,
+                                          options)
+            if path == root:
+                data = page
+            else:
+                set_summary(page, totals)
+                pages.append((filename, render_index(page, options)))
+                inputs[filename] = page
+    else:
+        row = index_row(options)
+        for f in keys:
+            cdata = covdata[f]
+            data['ROWS'].append(row(cdata._linked,
+                                    layout.link(cdata._sourcefile,
+                                                options.output),
+                                    data['DIRECTORY'], cdata._filename,
+                                    stats[f]))
 
-        data['ROWS'].append(html_row(options.html_details, cdata._sourcefile,
-                                     directory=data['DIRECTORY'],
-                                     filename=cdata._filename,
-                                     LinesExec=class_hits,
-                                     LinesTotal=class_lines,
-                                     LinesCoverage=lines_covered,
-                                     BranchesExec=class_branch_hits,
-                                     BranchesTotal=class_branches,
-                                     BranchesCoverage=branches_covered))
-    data['ROWS'] = '\n'.join(data['ROWS'])
+        if data['DIRECTORY'] == '':
+            data['DIRECTORY'] = "."
 
-    if data['DIRECTORY'] == '':
-        data['DIRECTORY'] = "."
+    pages.insert(0, (options.output, render_index(data, options)))
+    inputs[options.output] = data
 
-    htmlString = root_page.render(**data)
+    keys = [f for f in keys if covdata[f]._detailed]
 
-    if options.output is None:
-        sys.stdout.write(htmlString+'\n')
-    else:
-        OUTPUT = open(options.output, 'w')
+    # Only the pages whose inputs changed are written (with
+    # --html-incremental)
+    if manifest.filename is not None:
+        # The detail pages of the files that are no longer covered go
+        pruned = manifest.prune(
+            [filename for (filename, htmlString) in pages] +
+            [cdata._sourcefile for cdata in covdata.values()])
+        templates = template_digest(options)
+        pages = [(filename, htmlString) for (filename, htmlString) in pages
+                 if manifest.changed(filename, index_page_digest(
+                     filename, inputs[filename], templates, options))]
+        if options.html_details:
+            keys = [f for f in keys if manifest.changed(
+                covdata[f]._sourcefile,
+                source_page_digest(covdata[f], templates, options))]
+        if manifest.pending or pruned:
+            manifest.save()
+
+    for (filename, htmlString) in pages:
+        makedirs(os.path.dirname(os.path.abspath(filename)))
+        if filename in scripts:
+            content = (htmlString + '\n').encode('utf-8')
+            write_file(content, filename)
+            if precompress_pages(options):
+                write_file(gzip_bytes(content), filename + '.gz')
+            continue
+        OUTPUT = open_output(filename, options,
+                             precompress=precompress_pages(options))
         OUTPUT.write(htmlString + '\n')
-        OUTPUT.close()
+        close_output(OUTPUT)
 
     if options.html_details:
         print_html_details(keys, covdata, options)
+    manifest.commit()
 
+from pygments import __version__ as pygments_version
+from pygments import format as format_tokens
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import TextLexer
+from pygments.lexers import get_lexer_by_name
 from pygments.lexers import get_lexer_for_filename
+from pygments.util import ClassNotFound
+
+
+row_head = u'''<tr>
+<td class="exec"><a name="l' + str(linenum) + '" href="#l
+'''
+
+table_head = (u'''
+<table class="table table-compact table-striped">
+''', u'''
+<thead><tr><th>Line</th><th>Exec</th><th>Code</th></tr></thead><tbody>
+''')
+
+table_tail = u'</tbody></table>'
+
+
+#
+# The table row of the highlighted LINE (number LINENUM) of CDATA
+#
+def source_line_row(cdata, linenum, line):
+    html_class = ""
+    covered = ""
+    if linenum in cdata.covered:
+        html_class = " success"
+        covered = str(cdata.covered.get(linenum, 0))
+    elif linenum in cdata.uncovered:
+        html_class = " warning"
+    return u''.join((row_head, str(linenum), '">', str(linenum), '</a></td>',
+                     '<td class="exec">', covered,
+                     '</td><td class="pre', html_class, '">',
+                     line, '</td></tr>'))
 
 
 class GcovrHtmlFormatter(HtmlFormatter):
-    def __init__(self, covdata, **options):
+    def __init__(self, covdata, lines=None, **options):
         HtmlFormatter.__init__(self, **options)
         self.covdata = covdata
+        # The highlighted LINES of the source (an iterable, see
+        # highlight_lines), which are annotated instead of the formatted
+        # tokens
+        self.lines = lines
 
-    def wrap(self, source, outfile):
+    def wrap(self, source, outfile=None):
         linenum = 1
         cdata = self.covdata
-        yield 0, u'''
-<table class="table table-compact table-striped">
-'''
-        yield 0, u'''
-<thead><tr><th>Line</th><th>Exec</th><th>Code</th></tr></thead><tbody>
-'''
+        if self.lines is not None:
+            source = ((1, line) for line in self.lines)
+        for head in table_head:
+            yield 0, head
         for code, line in source:
             if code == 1:
-                html_class = ""
-                covered = ""
-                if linenum in cdata.covered:
-                    html_class = " success"
-                    covered = str(cdata.covered.get(linenum, 0))
-                elif linenum in cdata.uncovered:
-                    html_class = " warning"
-
-                l = u'<tr>'
-                l += u'''
-<td class="exec"><a name="l' + str(linenum) + '" href="#l
-'''
-                l += str(linenum) + '">' + str(linenum) + '</a></td>'
-                l += u'<td class="exec">' + covered
-                l += u'</td><td class="pre' + html_class + '">'
-                l += line
-                l += u'</td></tr>'
+                yield 1, source_line_row(cdata, linenum, line)
                 linenum += 1
-                yield 1, l
-        yield 0, u'</tbody></table>'
+        yield 0, table_tail
+
+
+class ChunkedSourcePages(object):
+    """The detail pages of a source file of NLINES lines, split into
+    FILENAMES of CHUNK_LINES lines each.  Every page is rendered from DATA,
+    with the links to the other pages and the overview strip of the
+    coverage of the whole file.  The highlighted lines are written to the
+    pages as they come, so only one page is open at a time."""
+
+    def __init__(self, cdata, filenames, nlines, chunk_lines, data, options):
+        self.cdata = cdata
+        self.filenames = filenames
+        self.chunk_lines = chunk_lines
+        self.options = options
+        self.data = dict(data)
+        self.data['ROWS'] = rows_marker
+        self.data['OVERVIEW'] = overview_strip(cdata, nlines, chunk_lines,
+                                               filenames)
+        self.chunks = []
+        for (i, filename) in enumerate(filenames):
+            self.chunks.append({
+                'link': os.path.basename(filename),
+                'first': i * chunk_lines + 1,
+                'last': min((i + 1) * chunk_lines, nlines),
+                'current': False})
+        self.page = -1
+        self.output = None
+        self.tail = None
+        self.linenum = 1
+        self.pending = u''
+        self._next_page()
+
+    def _close_page(self):
+        # The table is wrapped like the one of GcovrHtmlFormatter
+        self.output.write((table_tail + u'</div>\n').encode('utf-8'))
+        for chunk in self.tail:
+            self.output.write(chunk.encode('utf-8'))
+        close_output(self.output)
+        self.chunks[self.page]['current'] = False
+
+    def _next_page(self):
+        if self.output is not None:
+            self._close_page()
+        self.page += 1
+        self.chunks[self.page]['current'] = True
+        self.output = open_output(self.filenames[self.page], self.options,
+                                  binary=True,
+                                  precompress=precompress_pages(self.options))
+        self.tail = get_template('source.html', self.options).generate(
+            CHUNKS=self.chunks, **self.data)
+        for chunk in self.tail:
+            if rows_marker in chunk:
+                (head, chunk) = chunk.split(rows_marker)
+                self.output.write(head.encode('utf-8'))
+                self.tail = itertools.chain([chunk], self.tail)
+                break
+            self.output.write(chunk.encode('utf-8'))
+        head = u'<div class="highlight">' + u''.join(table_head)
+        self.output.write(head.encode('utf-8'))
+
+    def write(self, text):
+        lines = (self.pending + text).split(u'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            if self.linenum > (self.page + 1) * self.chunk_lines:
+                self._next_page()
+            self.output.write(source_line_row(
+                self.cdata, self.linenum, line + u'\n').encode('utf-8'))
+            self.linenum += 1
+
+    def close(self):
+        if self.pending:
+            self.write(u'\n')
+        while self.page + 1 < len(self.filenames):
+            self._next_page()
+        self._close_page()
+
+
+#
+# The names of the pages of a detail page PAGE of NLINES lines, split into
+# chunks of CHUNK_LINES lines (or not split, when CHUNK_LINES is 0)
+#
+def chunk_filenames(page, nlines, chunk_lines):
+    if not chunk_lines or nlines <= chunk_lines:
+        return [page]
+    suffix = ''
+    if page.endswith('.gz'):
+        (page, suffix) = (page[:-3], '.gz')
+    (root, ext) = os.path.splitext(page)
+    return [page + suffix] + [
+        '%s.%d%s%s' % (root, i + 1, ext, suffix)
+        for i in range(1, (nlines + chunk_lines - 1) // chunk_lines)]
+
+
+#
+# The overview strip of a file of NLINES lines: up to overview_segments
+# segments, which show whether their lines are (partly) uncovered, and
+# link to the page of the chunk where they start
+#
+def overview_strip(cdata, nlines, chunk_lines, filenames):
+    size = max(1, (nlines + overview_segments - 1) // overview_segments)
+    count = (nlines + size - 1) // size
+    covered = [False] * count
+    uncovered = [False] * count
+    for line in cdata.covered:
+        if 0 < line <= nlines:
+            covered[(line - 1) // size] = True
+    for line in cdata.uncovered:
+        if 0 < line <= nlines:
+            uncovered[(line - 1) // size] = True
+    segments = []
+    for i in range(count):
+        first = i * size + 1
+        last = min(first + size - 1, nlines)
+        if uncovered[i]:
+            color = low_color
+        elif covered[i]:
+            color = high_color
+        else:
+            color = None
+        segments.append({
+            'link': os.path.basename(
+                filenames[(first - 1) // chunk_lines]),
+            'title': '%d-%d' % (first, last),
+            'color': color,
+            'width': '%.3f' % (100.0 * (last - first + 1) / nlines)})
+    return segments
+
+
+overview_segments = 200
+
+
+def coverage_color(coverage):
+    if coverage < medium_coverage:
+        return low_color
+    elif coverage < high_coverage:
+        return medium_color
+    else:
+        return high_color
 
 
 def print_html_details(keys, covdata, options):
     #
-    # Generate an HTML file for every source file
+    # Generate an HTML file for every source file, with up to options.jobs
+    # worker processes.  Every page only depends on its own source file and
+    # coverage data, so the output does not depend on the number of jobs.
     #
-    for f in keys:
-        cdata = covdata[f]
-        data = {}
-        data['FILENAME'] = cdata._filename
-        data['ROWS'] = ''
-
-        options.show_branch = True
-        branchTotal, branchCovered, tmp = cdata.coverage(options.show_branch)
-        data['BRANCHES_EXEC'] = str(branchCovered)
-        data['BRANCHES_TOTAL'] = str(branchTotal)
-        if branchTotal == 0:
-            coverage = 0.0
-        else:
-            coverage = round(100.0 * branchCovered / branchTotal, 1)
-        data['BRANCHES_COVERAGE'] = str(coverage)
-        if coverage < medium_coverage:
-            data['BRANCHES_COLOR'] = low_color
-        elif coverage < high_coverage:
-            data['BRANCHES_COLOR'] = medium_color
-        else:
-            data['BRANCHES_COLOR'] = high_color
-
-        options.show_branch = False
-        lineTotal, lineCovered, tmp = cdata.coverage(options.show_branch)
-        data['LINES_EXEC'] = str(lineCovered)
-        data['LINES_TOTAL'] = str(lineTotal)
-        if lineTotal == 0:
-            coverage = 0.0
-        else:
-            coverage = round(100.0 * lineCovered / lineTotal, 1)
-        data['LINES_COVERAGE'] = str(coverage)
-        if coverage < medium_coverage:
-            data['LINES_COLOR'] = low_color
-        elif coverage < high_coverage:
-            data['LINES_COLOR'] = medium_color
+    for path in set(os.path.dirname(covdata[f]._sourcefile) for f in keys):
+        makedirs(path)
+    # Compiled (or loaded from the cache) once, before the workers start
+    get_template('source.html', options)
+    tasks = [(covdata[f], options) for f in keys]
+    jobs = min(getattr(options, 'jobs', 1), len(tasks))
+    if jobs <= 1:
+        for task in tasks:
+            print_html_source(task)
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(print_html_source, tasks,
+                                          chunksize=8):
+            pass
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+#
+# Generate the HTML file of a single source file.  This is called in the
+# worker processes of print_html_details, so it takes a single argument.
+#
+def print_html_source(task):
+    (cdata, options) = task
+    data = {}
+    data['FILENAME'] = cdata._filename
+    data['ROOT'] = page_root(cdata._sourcefile, options.output)
+    data['ROWS'] = ''
+
+    branchTotal, branchCovered, tmp = cdata.coverage(True)
+    data['BRANCHES_EXEC'] = str(branchCovered)
+    data['BRANCHES_TOTAL'] = str(branchTotal)
+    if branchTotal == 0:
+        coverage = 0.0
+    else:
+        coverage = round(100.0 * branchCovered / branchTotal, 1)
+    data['BRANCHES_COVERAGE'] = str(coverage)
+    data['BRANCHES_COLOR'] = coverage_color(coverage)
+
+    lineTotal, lineCovered, tmp = cdata.coverage(False)
+    data['LINES_EXEC'] = str(lineCovered)
+    data['LINES_TOTAL'] = str(lineTotal)
+    if lineTotal == 0:
+        coverage = 0.0
+    else:
+        coverage = round(100.0 * lineCovered / lineTotal, 1)
+    data['LINES_COVERAGE'] = str(coverage)
+    data['LINES_COLOR'] = coverage_color(coverage)
+
+    INPUT = open(os.path.join(options.root_dir, data['FILENAME']), 'rb')
+    code = INPUT.read()
+    INPUT.close()
+    lexer = get_lexer(data['FILENAME'], options)
+    # Without a cache, the tokens are formatted as they are lexed
+    cache_dir = getattr(options, 'cache_dir', None)
+    if cache_dir is None:
+        (tokens, lines) = (lexer.get_tokens(code), None)
+    else:
+        (tokens, lines) = (iter(()), highlight_lines(code, lexer, cache_dir))
+
+    # A large file is split into pages of --html-chunk-lines lines
+    chunk_lines = getattr(options, 'html_chunk_lines', 0)
+    nlines = code.count(b'\n') + (not code.endswith(b'\n'))
+    filenames = chunk_filenames(cdata._sourcefile, nlines, chunk_lines)
+    if len(filenames) > 1:
+        pages = ChunkedSourcePages(cdata, filenames, nlines, chunk_lines,
+                                   data, options)
+        if lines is None:
+            format_tokens(tokens, HtmlFormatter(nowrap=True), pages)
         else:
-            data['LINES_COLOR'] = high_color
+            for line in lines:
+                pages.write(line)
+        pages.close()
+        return
+
+    # The page is streamed to the file: the template is generated in chunks,
+    # and the annotated source is formatted into the file, row by row, where
+    # the ROWS marker appears.  Only the rows are streamed: pygments lexes
+    # the whole source, which is held in memory (as CODE) meanwhile.
+    data['ROWS'] = rows_marker
+    OUTPUT = open_output(cdata._sourcefile, options, binary=True,
+                         precompress=precompress_pages(options))
+    try:
+        for chunk in get_template('source.html', options).generate(**data):
+            if rows_marker in chunk:
+                (head, chunk) = chunk.split(rows_marker)
+                OUTPUT.write(head.encode('utf-8'))
+                format_tokens(tokens, GcovrHtmlFormatter(
+                    cdata, lines, encoding='utf-8'), OUTPUT)
+            OUTPUT.write(chunk.encode('utf-8'))
+    finally:
+        close_output(OUTPUT)
+
+
+rows_marker = u'\0ROWS\0'
+
+
+#
+# The lexers of the source files, by extension (or by name, for the files
+# without an extension) and by the --html-lexer name given for it, if any
+#
+lexer_cache = {}
 
-        currdir = os.getcwd()
-        os.chdir(options.root_dir)
 
-        INPUT = open(data['FILENAME'], 'rb')
-        code = INPUT.read()
-        formatter = GcovrHtmlFormatter(cdata)
+#
+# The lexer of the source file FILENAME, which only depends on its
+# extension: the lexer named for it by --html-lexer, or else the lexer
+# pygments has for the extension.  The source code is never looked at, so
+# the lexers are not tried on it in turn.
+#
+def get_lexer(filename, options):
+    (base, ext) = os.path.splitext(os.path.basename(filename))
+    key = ext or base
+    name = getattr(options, 'html_lexers', {}).get(key)
+    lexer = lexer_cache.get((key, name))
+    if lexer is None:
         try:
-            lexer = get_lexer_for_filename(data['FILENAME'], code,
-                                           encoding="utf-8")
-        except:
+            if name is not None:
+                lexer = get_lexer_by_name(name, encoding="utf-8")
+            else:
+                lexer = get_lexer_for_filename(ext and 'x' + ext or base,
+                                               encoding="utf-8")
+        except ClassNotFound:
+            if name is not None:
+                sys.stderr.write(
+                    "(WARNING) Unknown lexer '%s' for the %s files.\n"
+                    % (name, key))
             lexer = TextLexer()
-        buf = highlight(code, lexer, formatter)
-        data['ROWS'] = buf.encode('utf-8').decode('utf-8')
+        lexer_cache[(key, name)] = lexer
+    return lexer
 
-        os.chdir(currdir)
-        try:
-            htmlString = source_page.render(**data)
 
-            with open(cdata._sourcefile, 'w') as f:
-                f.write(htmlString.encode('utf-8'))
-        except:
-            print htmlString.__class__
-            print buf
-            raise
+#
+# Highlight the source CODE with LEXER, returning an iterator over the lines
+# of HTML.  The lines are kept in CACHE_DIR, in a file named after the hash
+# of the code, the name of the lexer and the version of pygments, so that
+# the source files that did not change since the previous run are not
+# tokenized again.
+#
+def highlight_lines(code, lexer, cache_dir):
+    key = hashlib.sha1(('%s\0%s\0' % (lexer.name, pygments_version))
+                       .encode('utf-8') + code)
+    key = key.hexdigest()
+    cache_file = os.path.join(cache_dir, 'highlight', key[:2], key)
+    if not os.path.exists(cache_file):
+        # Write to a temporary file first, as another process may be
+        # highlighting the same code
+        makedirs(os.path.dirname(cache_file))
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, 'wb') as f:
+            highlight(code, lexer, HtmlFormatter(nowrap=True,
+                                                 encoding='utf-8'), f)
+        try:
+            os.rename(tmp, cache_file)
+        except OSError:
+            os.remove(tmp)
+    return read_lines(cache_file)
 
 
-def source_row(lineno, source, cdata):
-    rowstr = Template(u'''
-    <tr>
-    <td>{{lineno}}</td>
-    <td class="{{covclass}}">{{linecount}}</td>
-    <td class="{{covclass}}">{{source}}</td>
-    </tr>''')
-    kwargs = {}
-    kwargs['lineno'] = str(lineno)
-    if lineno in cdata.covered:
-        kwargs['covclass'] = 'coveredLine'
-        kwargs['linecount'] = str(cdata.covered.get(lineno, 0))
-    elif lineno in cdata.uncovered:
-        kwargs['covclass'] = 'uncoveredLine'
-        kwargs['linecount'] = ''
-    else:
-        kwargs['covclass'] = ''
-        kwargs['linecount'] = ''
-    kwargs['source'] = html.escape(source)
-    return rowstr.render(**kwargs)
+def read_lines(filename):
+    with io.open(filename, encoding='utf-8', newline=u'\n') as f:
+        for line in f:
+            yield line
 
 
 nrows = 0
 
 
 #
-# Generate the table row for a single file
+# Collect the fields of the table row for a single file.  The rows are
+# rendered by the loop in index.html, which is compiled only once.
 #
 def html_row(details, sourcefile, **kwargs):
-    rowstr = Template(u'''
-    <tr>
-      <td>{{filename}}</td>
-      <td>
-        <div class="progress">
-            <div class="progress-bar progress-bar-{{LinesBar}}"
-                 role="progressbar"
-                 aria-valuenow="{{LinesCoverage}}"
-                 aria-valuemin="0" aria-valuemax="100"
-                 style="width: {{LinesCoverage}}%;"></div>
-            <span class="sr-only">{{LinesCoverage}}&nbsp;%</span>
-        </div>
-      </td>
-      <td class="{{LinesColor}}">{{LinesCoverage}}&nbsp;%</td>
-      <td class="{{LinesColor}}">{{LinesExec}} / {{LinesTotal}}</td>
-      <td class="{{BranchesColor}}">{{BranchesCoverage}}&nbsp;%</td>
-      <td class="{{BranchesColor}}">{{BranchesExec}} / {{BranchesTotal}}</td>
-    </tr>
-''')
     global nrows
     nrows += 1
     if details:
@@ -418,4 +1194,4 @@ def html_row(details, sourcefile, **kwargs):
         kwargs['BranchesColor'] = 'success'
         kwargs['BranchesBar'] = 'success'
 
-    return rowstr.render(**kwargs)
+    return kwargs
@@ -0,0 +1,72 @@
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+
+
+from .utils import open_output, close_output
+
+
+#
+# Produce an LCOV tracefile (as read by genhtml), with one record per
+# source file.  Every record is written as soon as it is formatted.
+#
+def print_lcov_report(covdata, options):
+    OUTPUT = open_output(options.output or None, options)
+    try:
+        for key in sorted(covdata.keys()):
+            OUTPUT.write(lcov_record(key, covdata[key]))
+    finally:
+        close_output(OUTPUT)
+
+
+#
+# The record of the source file FILENAME with the coverage data CDATA:
+# its functions, line counts and branch counts, with their totals
+#
+def lcov_record(filename, cdata):
+    lines = ['TN:', 'SF:' + filename]
+
+    functions = sorted(cdata.functions.items(),
+                       key=lambda item: (item[1][0], item[0]))
+    for (name, (line, calls)) in functions:
+        lines.append('FN:%d,%s' % (line, name))
+    for (name, (line, calls)) in functions:
+        lines.append('FNDA:%d,%s' % (calls, name))
+    lines.append('FNF:%d' % len(functions))
+    lines.append('FNH:%d' % len([f for f in functions if f[1][1] > 0]))
+
+    # gcov only numbers the blocks with --all-blocks, which the parser
+    # does not use, so every branch of a line is put in block 0.  The
+    # branches of blocks that were never executed are taken ('-').
+    branches = 0
+    branches_hit = 0
+    lines_with_branches = set(cdata.branches.keys())
+    lines_with_branches.update(cdata.unexecuted_branches.keys())
+    for line in sorted(lines_with_branches):
+        counts = dict(cdata.branches.get(line, {}))
+        counts.update((branch, '-')
+                      for branch in cdata.unexecuted_branches.get(line, ()))
+        for (branch, count) in sorted(counts.items()):
+            lines.append('BRDA:%d,0,%d,%s' % (line, branch, count))
+            branches += 1
+            if count != '-' and count > 0:
+                branches_hit += 1
+    lines.append('BRF:%d' % branches)
+    lines.append('BRH:%d' % branches_hit)
+
+    counts = dict((line, 0) for line in cdata.uncovered)
+    counts.update((line, 0) for line in cdata.uncovered_exceptional)
+    counts.update(cdata.covered)
+    for line in sorted(counts.keys()):
+        lines.append('DA:%d,%d' % (line, counts[line]))
+    lines.append('LF:%d' % len(counts))
+    lines.append('LH:%d' % len([c for c in counts.values() if c > 0]))
+
+    lines.append('end_of_record\n')
+    return '\n'.join(lines)
@@ -0,0 +1,29 @@
+#include <iostream>
+
+
+int foo(int param) {
+  if (param) {
+     return 1;
+  }
+  return 0;
+}
+
+
+int bar(int param) {
+  if (param > 1) {
+     return 2;
+  }
+  return param;
+}
+
+
+int main(int argc, char* argv[]) {
+  foo(0);
+  foo(1);
+
+  if (argc > 10) {
+     bar(argc);
+  }
+
+  return 0;
+}
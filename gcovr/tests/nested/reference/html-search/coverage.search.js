@@ -0,0 +1 @@
+var GCOVR_SEARCH = {"files":[["subdir/A/C/D/file6.cpp","coverage.subdir_A_C_D_file6.cpp.html"],["subdir/A/C/file5.cpp","coverage.subdir_A_C_file5.cpp.html"],["subdir/A/file1.cpp","coverage.subdir_A_file1.cpp.html"],["subdir/A/file2.cpp","coverage.subdir_A_file2.cpp.html"],["subdir/A/file3.cpp","coverage.subdir_A_file3.cpp.html"],["subdir/A/file4.cpp","coverage.subdir_A_file4.cpp.html"],["subdir/A/file7.cpp","coverage.subdir_A_file7.cpp.html"],["subdir/B/main.cpp","coverage.subdir_B_main.cpp.html"]],"trigrams":{".cp":[0,1,1,1,1,1,1,1],"/a/":[0,1,1,1,1,1,1],"/b/":[7],"/c/":[0,1],"/d/":[0],"/fi":[0,1,1,1,1,1,1],"/ma":[7],"1.c":[2],"2.c":[3],"3.c":[4],"4.c":[5],"5.c":[1],"6.c":[0],"7.c":[6],"a/c":[0,1],"a/f":[2,1,1,1,1],"ain":[7],"b/m":[7],"bdi":[0,1,1,1,1,1,1,1],"c/d":[0],"c/f":[1],"cpp":[0,1,1,1,1,1,1,1],"d/f":[0],"dir":[0,1,1,1,1,1,1,1],"e1.":[2],"e2.":[3],"e3.":[4],"e4.":[5],"e5.":[1],"e6.":[0],"e7.":[6],"fil":[0,1,1,1,1,1,1],"ile":[0,1,1,1,1,1,1],"in.":[7],"ir/":[0,1,1,1,1,1,1,1],"le1":[2],"le2":[3],"le3":[4],"le4":[5],"le5":[1],"le6":[0],"le7":[6],"mai":[7],"n.c":[7],"r/a":[0,1,1,1,1,1,1],"r/b":[7],"sub":[0,1,1,1,1,1,1,1],"ubd":[0,1,1,1,1,1,1,1]}};
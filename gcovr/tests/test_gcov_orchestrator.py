@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Check that the gcov orchestrator keeps several gcov processes in flight
+# for the data files of a single working directory.  gcov is replaced by a
+# script that records when it runs, and prints a gcov file to stdout.
+#
+# This is a plain unittest module rather than a make target of
+# test_gcovr.py: the overlap can only be seen in the timing of gcov runs
+# that take a while, which the test programs are far too small for, and
+# the orchestrator needs Python 3.8, while the pyutilib based tests also
+# run under Python 2.  It is still collected by nosetests.
+#
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+from gcovr.data import GcovHistory, _gcov_stdout_cache
+
+try:
+    from gcovr.gcov_orchestrator import GcovOrchestrator
+except (ImportError, SyntaxError):
+    GcovOrchestrator = None
+
+fake_gcov = """#! %(python)s
+import os
+import sys
+import time
+
+if sys.argv[1] == '--help':
+    sys.stdout.write("  -t, --stdout   Output to stdout instead of a file\\n")
+    sys.exit(0)
+start = time.time()
+time.sleep(0.5)
+source = os.path.splitext(os.path.basename(sys.argv[1]))[0] + '.cpp'
+sys.stdout.write("        -:    0:Source:%%s\\n" %% source)
+sys.stdout.write("        1:    1:int main() { return 0; }\\n")
+with open(%(log)r, 'a') as log:
+    log.write("%%r %%r\\n" %% (start, time.time()))
+"""
+
+
+class Options(object):
+    objdir = None
+    gcov_prefix = None
+    gcov_prefix_strip = 0
+    gcov_filter = re.compile('')
+    gcov_exclude = []
+    keep = False
+    delete = False
+    verbose = False
+
+
+class GcovOrchestratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='gcovr-test-')
+        self.log = os.path.join(self.tmpdir, 'gcov.log')
+        self.options = Options()
+        self.options.gcov_cmd = os.path.join(self.tmpdir, 'gcov')
+        with open(self.options.gcov_cmd, 'w') as script:
+            script.write(fake_gcov % dict(python=sys.executable, log=self.log))
+        os.chmod(self.options.gcov_cmd, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @unittest.skipIf(GcovOrchestrator is None, "requires Python 3.8")
+    def test_gcov_probed_before_loop(self):
+        self.options.jobs = 2
+        orchestrator = GcovOrchestrator(self.options, GcovHistory(),
+                                        self.tmpdir)
+        orchestrator.run([], lambda fname: None)
+        self.assertEqual(_gcov_stdout_cache.get(self.options.gcov_cmd), True)
+
+    @unittest.skipIf(GcovOrchestrator is None, "requires Python 3.8")
+    def test_same_wd_overlaps(self):
+        objdir = os.path.join(self.tmpdir, 'obj')
+        os.mkdir(objdir)
+        datafiles = []
+        for name in ('a', 'b', 'c'):
+            for ext in ('.gcno', '.gcda'):
+                open(os.path.join(objdir, name + ext), 'w').close()
+            datafiles.append(os.path.join(objdir, name + '.gcda'))
+        scratch = os.path.join(self.tmpdir, 'scratch')
+        os.mkdir(scratch)
+
+        self.options.jobs = 3
+        emitted = []
+        orchestrator = GcovOrchestrator(self.options, GcovHistory(), scratch)
+        orchestrator.run(datafiles, emitted.append)
+
+        sources = []
+        for fname in emitted:
+            with open(fname) as gcov_file:
+                sources.append(gcov_file.readline().split(':', 3)[-1])
+        self.assertEqual(sorted(sources), ['a.cpp\n', 'b.cpp\n', 'c.cpp\n'])
+        with open(self.log) as log:
+            runs = [tuple(map(float, line.split())) for line in log]
+        self.assertEqual(len(runs), 3)
+        # every run started before the first one finished
+        self.assertTrue(max([start for start, end in runs]) <
+                        min([end for start, end in runs]))
+        # and the working directory was left alone
+        self.assertEqual(sorted(os.listdir(objdir)),
+                         ['a.gcda', 'a.gcno', 'b.gcda', 'b.gcno',
+                          'c.gcda', 'c.gcno'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -65,6 +65,73 @@ class GcovrHtml(unittest.TestCase):
 GcovrHtml = unittest.category('smoke')(GcovrHtml)
 
 
+class GcovrLcov(unittest.TestCase):
+    def __init__(self, *args, **kwds):
+        unittest.TestCase.__init__(self, *args, **kwds)
+
+    def compare_lcov(self):
+        # The tracefile names the sources by their absolute paths
+        F = open("coverage.lcov")
+        testData = F.read().replace("SF:" + os.getcwd() + os.sep, "SF:")
+        F.close()
+        F = open('coverage.lcov', 'w')
+        F.write(testData)
+        F.close()
+        self.assertFileEqualsBaseline('coverage.lcov', os.path.join('reference','coverage.lcov'))
+
+GcovrLcov = unittest.category('smoke')(GcovrLcov)
+
+
+class GcovrTarget(unittest.TestCase):
+    def __init__(self, *args, **kwds):
+        unittest.TestCase.__init__(self, *args, **kwds)
+        self.maxDiff = None
+        self.xml_re = re.compile('((timestamp)|(version))="[^"]*"')
+        self.date_re = re.compile('[0-9]{4}-[0-9]{2}-[0-9]{2}')
+        self.version_re = re.compile('\\(Version [^)]*\\)')
+        # The XML reports are compared within a tolerance of 1e-4, as the
+        # rates are written with more digits by Python 3 than by Python 2
+        self.float_re = re.compile('[0-9]+\\.[0-9]{5,}')
+
+    def read_output(self, filename):
+        F = open(filename)
+        data = F.read().replace("\r","")
+        F.close()
+        data = self.xml_re.sub('\\1=""', data)
+        data = self.date_re.sub('DATE', data)
+        data = self.version_re.sub('(Version)', data)
+        return self.float_re.sub(lambda m: '%.4f' % float(m.group(0)), data)
+
+    def compare_target(self, target):
+        # The target writes its files into the directory named after it,
+        # which must hold the files of the reference directory of that name
+        testFiles = list_files(target)
+        refFiles = list_files(os.path.join('reference', target))
+        self.assertEqual(testFiles, refFiles)
+        for name in testFiles:
+            self.assertEqual(
+                self.read_output(os.path.join(target, name)),
+                self.read_output(os.path.join('reference', target, name)),
+                name)
+
+GcovrTarget = unittest.category('smoke')(GcovrTarget)
+
+
+class GcovrCheck(unittest.TestCase):
+    def __init__(self, *args, **kwds):
+        unittest.TestCase.__init__(self, *args, **kwds)
+
+GcovrCheck = unittest.category('smoke')(GcovrCheck)
+
+
+def list_files(directory):
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        for name in filenames:
+            name = os.path.relpath(os.path.join(dirpath, name), directory)
+            files.append(name.replace(os.sep, '/'))
+    return sorted(files)
+
 def run(cmd):
     try:
         proc = subprocess.Popen( cmd,
@@ -113,6 +180,41 @@ def gcovr_test_html(self, name):
     run(["make","clean"]) or self.fail("Clean failed")
     os.chdir(basedir)
 
+@unittest.nottest
+def gcovr_test_lcov(self, name):
+    os.chdir(os.path.join(basedir,name))
+    run(["make","clean"]) or self.fail("Clean failed")
+    run(["make"]) or self.fail("Make failed")
+    run(["make","lcov"]) or self.fail("Execution failed")
+    self.compare_lcov()
+    run(["make","clean"]) or self.fail("Clean failed")
+    os.chdir(basedir)
+
+@unittest.nottest
+def gcovr_test_target(self, name):
+    (name, target) = name.split('/')
+    os.chdir(os.path.join(basedir,name))
+    run(["make","clean"]) or self.fail("Clean failed")
+    run(["make"]) or self.fail("Make failed")
+    run(["make",target]) or self.fail("Execution failed")
+    self.compare_target(target)
+    run(["make","clean"]) or self.fail("Clean failed")
+    os.chdir(basedir)
+
+@unittest.nottest
+def gcovr_test_check(self, name):
+    # The make target compares the output of a run with the options under
+    # test to that of a plain run, and fails if they differ
+    (name, target) = name.split('/')
+    os.chdir(os.path.join(basedir,name))
+    run(["make","clean"]) or self.fail("Clean failed")
+    run(["make"]) or self.fail("Make failed")
+    run(["make",target]) or self.fail("Check failed")
+    run(["make","clean"]) or self.fail("Clean failed")
+    os.chdir(basedir)
+
+check_re = re.compile('^(check-[\\w-]+):', re.M)
+
 skip_dirs = [ '.', '..', '.svn' ]
 
 for f in os.listdir(basedir):
@@ -122,6 +224,18 @@ for f in os.listdir(basedir):
         GcovrTxt.add_fn_test(fn=gcovr_test_txt, name=f)
         GcovrXml.add_fn_test(fn=gcovr_test_xml, name=f)
         #GcovrHtml.add_fn_test(fn=gcovr_test_html, name=f)
+        if os.path.exists(os.path.join(basedir,f,'reference','coverage.lcov')):
+            GcovrLcov.add_fn_test(fn=gcovr_test_lcov, name=f)
+        # Every directory of reference files is written by the make target
+        # of its name, for the output formats of their own
+        refdir = os.path.join(basedir,f,'reference')
+        for target in sorted(os.listdir(refdir)):
+            if os.path.isdir(os.path.join(refdir,target)):
+                GcovrTarget.add_fn_test(fn=gcovr_test_target, name=f+'/'+target)
+        F = open(os.path.join(basedir,f,'Makefile'))
+        for target in check_re.findall(F.read()):
+            GcovrCheck.add_fn_test(fn=gcovr_test_check, name=f+'/'+target)
+        F.close()
 	
 if __name__ == "__main__":
     unittest.main()
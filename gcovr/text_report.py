@@ -9,7 +9,7 @@
 #  _________________________________________________________________________
 
 
-import sys
+from .utils import open_output, close_output
 
 
 #
@@ -30,10 +30,7 @@ def print_text_report(covdata, options):
     def _alpha(key):
         return key
 
-    if options.output:
-        OUTPUT = open(options.output, 'w')
-    else:
-        OUTPUT = sys.stdout
+    OUTPUT = open_output(options.output or None, options)
     total_lines = 0
     total_covered = 0
     # Header
@@ -65,5 +62,4 @@ def print_text_report(covdata, options):
     OUTPUT.write("-"*78 + '\n')
 
     # Close logfile
-    if options.output:
-        OUTPUT.close()
+    close_output(OUTPUT)
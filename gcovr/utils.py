@@ -0,0 +1,73 @@
+#  _________________________________________________________________________
+#
+#  Gcovr: A parsing and reporting tool for gcov
+#  Copyright (c) 2013 Sandia Corporation.
+#  This software is distributed under the BSD License.
+#  Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+#  the U.S. Government retains certain rights in this software.
+#  For more information, see the README.md file.
+#  _________________________________________________________________________
+
+import gzip
+import io
+import sys
+
+
+#
+# Whether the report file FILENAME is compressed: when the name ends in .gz,
+# or when the --gzip option is given.  Reports printed to stdout (a None
+# FILENAME) are never compressed.
+#
+def is_compressed(filename, options):
+    if filename is None:
+        return False
+    return getattr(options, 'gzip', False) or filename.endswith('.gz')
+
+
+class TeeOutput(object):
+    """A stream that writes to all of its STREAMS"""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, data):
+        for stream in self.streams:
+            stream.write(data)
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+
+
+#
+# Open FILENAME (or stdout, when it is None) for writing a report.  The
+# report is compressed as it is written when is_compressed().  A BINARY
+# stream takes encoded bytes.
+# With PRECOMPRESS, an uncompressed file is written along with a
+# compressed copy named FILENAME.gz.  Close the stream with close_output().
+#
+def open_output(filename, options, binary=False, precompress=False):
+    if not is_compressed(filename, options):
+        if filename is None:
+            if binary:
+                return getattr(sys.stdout, 'buffer', sys.stdout)
+            return sys.stdout
+        stream = open(filename, binary and 'wb' or 'w')
+        if precompress:
+            # Like the static files, without a timestamp (see gzip_bytes)
+            copy = gzip.GzipFile(filename + '.gz', 'wb', mtime=0)
+            if not binary and sys.version_info >= (3, 0):
+                copy = io.TextIOWrapper(copy)
+            stream = TeeOutput(stream, copy)
+        return stream
+    stream = gzip.GzipFile(filename, 'wb')
+    if not binary and sys.version_info >= (3, 0):
+        stream = io.TextIOWrapper(stream)
+    return stream
+
+
+def close_output(stream):
+    if stream in (sys.stdout, getattr(sys.stdout, 'buffer', None)):
+        stream.flush()
+    else:
+        stream.close()
@@ -9,17 +9,95 @@
 #  _________________________________________________________________________
 
 from .version import version_str
+from .utils import open_output, close_output
 
 import os
-import sys
 import time
-import xml.dom.minidom
+
+
+#
+# Write an XML document incrementally.  The output is formatted like
+# xml.dom.minidom's toprettyxml(): one element per line, attributes in
+# sorted order, and elements holding only text kept on a single line.
+#
+# With an INDENT, the elements are indented by nesting level; with a
+# WIDTH, start tags that would exceed it are wrapped between attributes,
+# with the continuation lines indented one step further.
+#
+class XmlWriter(object):
+
+    def __init__(self, write, indent="", width=None):
+        self.write = write
+        self.indent = indent
+        self.width = width
+        self.depth = 0
+
+    def declaration(self, name, system_id):
+        self.write('<?xml version="1.0" ?>\n'
+                   "<!DOCTYPE %s\n  SYSTEM '%s'>\n" % (name, system_id))
+
+    def _tag(self, tag, attrs, close):
+        indent = self.indent * self.depth
+        line = indent + "<" + tag
+        if not attrs:
+            return line + close
+        pieces = [' %s="%s"' % (name, xml_escape(attrs[name]))
+                  for name in sorted(attrs)]
+        pieces[-1] += close
+        if self.width is None:
+            return line + "".join(pieces)
+        out = []
+        for piece in pieces:
+            if len(line) + len(piece) > self.width:
+                out.append(line)
+                line = indent + self.indent + piece[1:]
+            else:
+                line += piece
+        out.append(line)
+        return "\n".join(out)
+
+    def start(self, tag, attrs={}):
+        self.write(self._tag(tag, attrs, ">") + "\n")
+        self.depth += 1
+
+    def end(self, tag):
+        self.depth -= 1
+        self.write("%s</%s>\n" % (self.indent * self.depth, tag))
+
+    def element(self, tag, attrs={}, text=None):
+        if text is None:
+            self.write(self._tag(tag, attrs, "/>") + "\n")
+        else:
+            self.write("%s%s</%s>\n"
+                       % (self._tag(tag, attrs, ">"), xml_escape(text), tag))
+
+
+def xml_escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
 
 
 #
 # Produce an XML report in the Cobertura format
 #
 def print_xml_report(covdata, options):
+    OUTPUT = open_output(options.output, options)
+    if options.prettyxml:
+        writer = XmlWriter(OUTPUT.write, " ", 78)
+    else:
+        writer = XmlWriter(OUTPUT.write)
+    write_xml_report(covdata, options, writer)
+    OUTPUT.write('\n')
+    close_output(OUTPUT)
+
+
+#
+# Write the Cobertura document through WRITER.  The summaries of the
+# packages and classes are computed in a first pass over the data, as they
+# precede the lines in the document; the lines are then written as the
+# data is iterated a second time, so that they are never held in memory.
+#
+def write_xml_report(covdata, options, writer):
     branchTotal = 0
     branchCovered = 0
     lineTotal = 0
@@ -35,27 +113,6 @@ def print_xml_report(covdata, options):
         lineTotal += total
         lineCovered += covered
 
-    impl = xml.dom.minidom.getDOMImplementation()
-    docType = impl.createDocumentType(
-        "coverage", None,
-        "http://cobertura.sourceforge.net/xml/coverage-03.dtd")
-    doc = impl.createDocument(None, "coverage", docType)
-    root = doc.documentElement
-    root.setAttribute("line-rate", lineTotal == 0 and '0.0' or
-                      str(float(lineCovered) / lineTotal))
-    root.setAttribute("branch-rate", branchTotal == 0 and '0.0' or
-                      str(float(branchCovered) / branchTotal))
-    root.setAttribute("timestamp", str(int(time.time())))
-    root.setAttribute("version", "gcovr %s" % (version_str(),))
-
-    # Generate the <sources> element: this is either the root directory
-    # (specified by --root), or the CWD.
-    sources = doc.createElement("sources")
-    root.appendChild(sources)
-
-    # Generate the coverage output (on a per-package basis)
-    packageXml = doc.createElement("packages")
-    root.appendChild(packageXml)
     packages = {}
     source_dirs = set()
 
@@ -77,97 +134,55 @@ def print_xml_report(covdata, options):
             dir = f
         (dir, fname) = os.path.split(dir)
 
-        package = packages.setdefault(
-            dir, [doc.createElement("package"), {},
-                  0, 0, 0, 0])
-        c = doc.createElement("class")
-        # The Cobertura DTD requires a methods section, which isn't
-        # trivial to get from gcov (so we will leave it blank)
-        c.appendChild(doc.createElement("methods"))
-        lines = doc.createElement("lines")
-        c.appendChild(lines)
+        package = packages.setdefault(dir, [{}, 0, 0, 0, 0])
 
         class_lines = 0
         class_hits = 0
         class_branches = 0
         class_branch_hits = 0
         for line in data.all_lines:
-            hits = data.covered.get(line, 0)
             class_lines += 1
-            if hits > 0:
+            if data.covered.get(line, 0) > 0:
                 class_hits += 1
-            l = doc.createElement("line")
-            l.setAttribute("number", str(line))
-            l.setAttribute("hits", str(hits))
             branches = data.branches.get(line)
-            if branches is None:
-                l.setAttribute("branch", "false")
-            else:
-                b_hits = 0
+            if branches is not None:
                 for v in branches.values():
                     if v > 0:
-                        b_hits += 1
-                coverage = 100*b_hits/len(branches)
-                l.setAttribute("branch", "true")
-                l.setAttribute("condition-coverage",
-                               "%i%% (%i/%i)"
-                               % (coverage, b_hits, len(branches)))
-                cond = doc.createElement('condition')
-                cond.setAttribute("number", "0")
-                cond.setAttribute("type", "jump")
-                cond.setAttribute("coverage", "%i%%" % (coverage))
-                class_branch_hits += b_hits
+                        class_branch_hits += 1
                 class_branches += float(len(branches))
-                conditions = doc.createElement("conditions")
-                conditions.appendChild(cond)
-                l.appendChild(conditions)
-
-            lines.appendChild(l)
 
         className = fname.replace('.', '_')
-        c.setAttribute("name", className)
-        c.setAttribute("filename", os.path.join(dir, fname))
-        c.setAttribute("line-rate", str(class_hits / (1.0*class_lines or 1.0)))
-        c.setAttribute("branch-rate",
-                       str(class_branch_hits / (1.0*class_branches or 1.0)))
-        c.setAttribute("complexity", "0.0")
-
-        package[1][className] = c
-        package[2] += class_hits
-        package[3] += class_lines
-        package[4] += class_branch_hits
-        package[5] += class_branches
+        package[0][className] = (data, {
+            "name": className,
+            "filename": os.path.join(dir, fname),
+            "line-rate": str(class_hits / (1.0*class_lines or 1.0)),
+            "branch-rate":
+                str(class_branch_hits / (1.0*class_branches or 1.0)),
+            "complexity": "0.0"})
+        package[1] += class_hits
+        package[2] += class_lines
+        package[3] += class_branch_hits
+        package[4] += class_branches
 
-    keys = list(packages.keys())
-    keys.sort()
-    for packageName in keys:
-        packageData = packages[packageName]
-        package = packageData[0]
-        packageXml.appendChild(package)
-        classes = doc.createElement("classes")
-        package.appendChild(classes)
-        classNames = list(packageData[1].keys())
-        classNames.sort()
-        for className in classNames:
-            classes.appendChild(packageData[1][className])
-        package.setAttribute("name", packageName.replace(os.sep, '.'))
-        line_rate = packageData[2] / (1.0 * packageData[3] or 1.0)
-        package.setAttribute("line-rate", str(line_rate))
-        branch_rate = packageData[4] / (1.0 * packageData[5] or 1.0)
-        package.setAttribute("branch-rate", str(branch_rate))
-        package.setAttribute("complexity", "0.0")
-
-    # Populate the <sources> element: this is either the root directory
+    writer.declaration(
+        "coverage", "http://cobertura.sourceforge.net/xml/coverage-03.dtd")
+    writer.start("coverage", {
+        "line-rate": lineTotal == 0 and '0.0' or
+            str(float(lineCovered) / lineTotal),
+        "branch-rate": branchTotal == 0 and '0.0' or
+            str(float(branchCovered) / branchTotal),
+        "timestamp": str(int(time.time())),
+        "version": "gcovr %s" % (version_str(),)})
+
+    # Generate the <sources> element: this is either the root directory
     # (specified by --root), or relative directories based
     # on the filter, or the CWD
+    writer.start("sources")
     if options.root is not None:
-        source = doc.createElement("source")
-        source.appendChild(doc.createTextNode(options.root.strip()))
-        sources.appendChild(source)
+        writer.element("source", text=options.root.strip())
     elif len(source_dirs) > 0:
         cwd = os.getcwd()
         for d in source_dirs:
-            source = doc.createElement("source")
             if d.startswith(cwd):
                 reldir = d[len(cwd):].lstrip(os.path.sep)
             elif cwd.startswith(d):
@@ -177,32 +192,74 @@ def print_xml_report(covdata, options):
                     reldir = os.path.join(reldir, os.pardir)
             else:
                 reldir = d
-            source.appendChild(doc.createTextNode(reldir.strip()))
-            sources.appendChild(source)
+            writer.element("source", text=reldir.strip())
     else:
-        source = doc.createElement("source")
-        source.appendChild(doc.createTextNode('.'))
-        sources.appendChild(source)
+        writer.element("source", text='.')
+    writer.end("sources")
 
-    if options.prettyxml:
-        import textwrap
-        lines = doc.toprettyxml(" ").split('\n')
-        for i in xrange(len(lines)):
-            n = 0
-            while n < len(lines[i]) and lines[i][n] == " ":
-                n += 1
-            indent = " " + n * " "
-            lines[i] = "\n".join(textwrap.wrap(lines[i], 78,
-                                               break_long_words=False,
-                                               break_on_hyphens=False,
-                                               subsequent_indent=indent))
-        xmlString = "\n".join(lines)
-        #print textwrap.wrap(doc.toprettyxml(" "), 80)
-    else:
-        xmlString = doc.toprettyxml(indent="")
-    if options.output is None:
-        sys.stdout.write(xmlString+'\n')
+    # Generate the coverage output (on a per-package basis)
+    keys = list(packages.keys())
+    keys.sort()
+    if not keys:
+        writer.element("packages")
     else:
-        OUTPUT = open(options.output, 'w')
-        OUTPUT.write(xmlString + '\n')
-        OUTPUT.close()
+        writer.start("packages")
+    for packageName in keys:
+        packageData = packages[packageName]
+        writer.start("package", {
+            "name": packageName.replace(os.sep, '.'),
+            "line-rate": str(packageData[1] / (1.0 * packageData[2] or 1.0)),
+            "branch-rate":
+                str(packageData[3] / (1.0 * packageData[4] or 1.0)),
+            "complexity": "0.0"})
+        writer.start("classes")
+        classNames = list(packageData[0].keys())
+        classNames.sort()
+        for className in classNames:
+            (data, attrs) = packageData[0][className]
+            writer.start("class", attrs)
+            # The Cobertura DTD requires a methods section, which isn't
+            # trivial to get from gcov (so we will leave it blank)
+            writer.element("methods")
+            write_lines(data, writer)
+            writer.end("class")
+        writer.end("classes")
+        writer.end("package")
+    if keys:
+        writer.end("packages")
+    writer.end("coverage")
+
+
+def write_lines(data, writer):
+    if not data.all_lines:
+        writer.element("lines")
+        return
+    writer.start("lines")
+    for line in data.all_lines:
+        hits = data.covered.get(line, 0)
+        branches = data.branches.get(line)
+        if branches is None:
+            writer.element("line", {
+                "number": str(line),
+                "hits": str(hits),
+                "branch": "false"})
+            continue
+        b_hits = 0
+        for v in branches.values():
+            if v > 0:
+                b_hits += 1
+        coverage = 100*b_hits/len(branches)
+        writer.start("line", {
+            "number": str(line),
+            "hits": str(hits),
+            "branch": "true",
+            "condition-coverage":
+                "%i%% (%i/%i)" % (coverage, b_hits, len(branches))})
+        writer.start("conditions")
+        writer.element("condition", {
+            "number": "0",
+            "type": "jump",
+            "coverage": "%i%%" % (coverage)})
+        writer.end("conditions")
+        writer.end("line")
+    writer.end("lines")